@@ -6,6 +6,6 @@ setup(
     version='0.0.1',
     python_requires='>=3.5',
     install_requires=['pandas==0.23.4', 'numpy>=1.17', 'matplotlib', 'xlrd',
-                      'joblib', 'cmocean'],
+                      'joblib', 'cmocean', 'scipy'],
     scripts=[]
 )
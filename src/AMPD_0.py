@@ -2,6 +2,7 @@ import os
 import pandas as pd
 import logging
 from joblib import Parallel, delayed
+from load import data_file, write_data
 import time
 
 DATA_PATH = os.getenv('DATA_PATH')
@@ -35,9 +36,7 @@ def AMPD_0(year=2016):
     logger.info('Combining data')
     df = pd.concat(df_list)
     logger.info('Saving file')
-    path_out = os.path.join(DATA_PATH, 'analysis', 'AMPD_0.csv')
-
-    df.to_csv(path_out, index=False)
+    write_data(df, data_file('AMPD_0'), index=False)
     logger.info('%.2fmin so far' % ((time.time() - start_time)/60.0))
 
 
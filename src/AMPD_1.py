@@ -5,7 +5,7 @@ AMPD step 1
 import os
 import numpy as np
 import logging
-from load import AMPD, EGRID
+from load import AMPD, EGRID, data_file, time_steps, write_data
 
 
 DATA_PATH = os.getenv('DATA_PATH')
@@ -13,13 +13,16 @@ if DATA_PATH is None:
     raise ValueError("DATA_PATH needs to be set")
 
 
-def AMPD_1():
+def AMPD_1(year=2016):
     '''
     PLNT-level cleaning.
     '''
     logger = logging.getLogger('clean')
     logger.info("Starting AMPD_1")
 
+    # AMPD data is hourly
+    n_hours = len(time_steps(year, freq="H"))
+
     # Load result from step 0
     ampd = AMPD(step=0)
 
@@ -32,7 +35,7 @@ def AMPD_1():
     # Drop the AMPD plants that do not have enough timestamps
     x = ampd.df.loc[:, ["ORISPL_CODE", "OP_DATE_TIME"]].groupby(
         'ORISPL_CODE').count()
-    to_drop = x.mask(x > 8600).dropna()
+    to_drop = x.mask(x > n_hours - 184).dropna()
     print("Dropping %d plants out of %d that do not have enough timestamps" % (
             len(to_drop), len(x)))
     ampd.df = ampd.df[~ampd.df.ORISPL_CODE.isin(to_drop.index.values)]
@@ -82,16 +85,16 @@ def AMPD_1():
                 | (diff.NOX.abs() > tol)]
     logger.debug(diff.describe())
 
-    # Check that all of the plants have 8,784 timesteps
+    # Check that all of the plants have n_hours timesteps
     timesteps = ampd.df.loc[:, ['ORISPL_CODE', 'OP_DATE_TIME']].groupby(
         'ORISPL_CODE').count()
-    logger.debug(np.sum(~(timesteps == 8784)))
+    logger.debug(np.sum(~(timesteps == n_hours)))
 
     # try to reconcile ampd with egrid unadjusted
     for code in diff.index.values:
         for col in ["CO2", "SO2", "NOX"]:
             ampd.df.loc[ampd.df.ORISPL_CODE == code, col] += diff.loc[
-                code, col] / 8784
+                code, col] / n_hours
 
     # Check results
     ampd_ann2 = ampd.df.loc[:, ['ORISPL_CODE', 'CO2', 'SO2', 'NOX']].groupby(
@@ -170,7 +173,7 @@ def AMPD_1():
     for code in diff.index.values:
         for col in ["CO2", "SO2", "NOX"]:
             ampd.df.loc[ampd.df.ORISPL_CODE == code, col] += diff.loc[
-                code, col] / 8784
+                code, col] / n_hours
 
     # Recalculate AMPD annual totals
     logger.info("Final round of adjustments")
@@ -199,7 +202,7 @@ def AMPD_1():
     for code in diff2.index.values:
         for col in ["CO2", "SO2", "NOX"]:
             ampd.df.loc[ampd.df.ORISPL_CODE == code, col] += diff2.loc[
-                code, col] / 8784
+                code, col] / n_hours
 
     # final check
     ampd_ann3 = ampd.df.loc[:, ['ORISPL_CODE', 'CO2', 'SO2', 'NOX']].groupby(
@@ -219,5 +222,4 @@ def AMPD_1():
 
     # Save data
     logger.info("AMPD 1 - Saving data")
-    fileNm_out = os.path.join(DATA_PATH, 'analysis', 'AMPD_1.csv')
-    ampd.df.to_csv(fileNm_out)
+    write_data(ampd.df, data_file('AMPD_1'))
@@ -6,7 +6,7 @@ import os
 import pandas as pd
 import numpy as np
 import logging
-from load import AMPD, EGRID
+from load import AMPD, EGRID, data_file, time_steps, to_time_step, write_data
 
 
 DATA_PATH = os.getenv('DATA_PATH')
@@ -14,16 +14,21 @@ if DATA_PATH is None:
     raise ValueError("DATA_PATH needs to be set")
 
 
-def AMPD_2():
+def AMPD_2(year=2016):
     '''
     BA-level cleaning.
     Adjust AMPD data so that annual BA-level totals matches eGRID data. In this
     version, we use BA-level data only from eGRID to make the adjustment, and
     split the adjustment equally over all timesteps.
+    The hourly data is then split evenly over the time steps of the EBA data
+    (see load.TIME_STEP).
     '''
     logger = logging.getLogger('clean')
     logger.info("Starting AMPD_2")
 
+    # AMPD data is hourly
+    n_hours = len(time_steps(year, freq="H"))
+
     # Load AMPD data
     ampd = AMPD(step=1)
 
@@ -75,7 +80,7 @@ def AMPD_2():
 
     timesteps = ampd_ba.loc[:, ['BACODE', 'DATE_TIME_UTC']].groupby(
         'BACODE').count()
-    logger.debug((~(timesteps == 8784)).sum())
+    logger.debug((~(timesteps == n_hours)).sum())
 
     # try to reconcile ampd with egrid unadjusted
     # note: could also do this with monthly data if available?
@@ -85,7 +90,7 @@ def AMPD_2():
     for bacode in diff.index.values:
         for col in ["CO2", "SO2", "NOX"]:
             ampd_ba.loc[ampd_ba.BACODE == bacode, col] += diff.loc[
-                bacode, col] / 8784
+                bacode, col] / n_hours
 
     # Check that this happened as expected
     ampd_ba_ann = ampd_ba.groupby('BACODE').sum()
@@ -146,10 +151,12 @@ def AMPD_2():
     ampd_ba_p.columns = ['_'.join(col).strip() for col in
                          ampd_ba_p.columns.values]
 
+    # Split hourly emissions over sub-hourly time steps
+    ampd_ba_p = to_time_step(ampd_ba_p)
+
     # Save data
     logger.info("AMPD_2 - saving data")
-    fileNm_out = os.path.join(DATA_PATH, 'analysis', 'AMPD_2.csv')
-    ampd_ba_p.to_csv(fileNm_out)
+    write_data(ampd_ba_p, data_file('AMPD_2'))
 
 
 def getTimezoneInfo():
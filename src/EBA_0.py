@@ -5,7 +5,7 @@ import json
 import re
 import logging
 import time
-from load import EGRID
+from load import EGRID, data_file, write_data
 
 DATA_PATH = os.getenv('DATA_PATH')
 if DATA_PATH is None:
@@ -82,4 +82,4 @@ def EBA_0():
     df_extract = pd.concat(df_list, axis=1)
 
     logger.info("Saving EBA_0 data")
-    df_extract.to_csv(os.path.join(DATA_PATH, "analysis/EBA_0.csv"))
+    write_data(df_extract, data_file("EBA_0"))
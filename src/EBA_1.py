@@ -1,9 +1,8 @@
 import os
-import pandas as pd
 import numpy as np
 import logging
 import pickle
-from load import BA_DATA, EGRID
+from load import BA_DATA, EGRID, data_file, time_steps, write_data
 
 DATA_PATH = os.getenv('DATA_PATH')
 if DATA_PATH is None:
@@ -29,8 +28,8 @@ def EBA_1(clip=False):
     eba = BA_DATA(step=0)
 
     # 1. Restrict to 2016 data in UTC
-    eba.df = eba.df.loc[pd.to_datetime("20160101"):pd.to_datetime(
-        "2016-12-31 23:00:00")]
+    steps = time_steps(2016)
+    eba.df = eba.df.loc[steps[0]:steps[-1]]
 
     # 2. Drop demand forecast columns
     eba.df.drop(columns=[col for col in eba.df.columns if 'DF.H' in col],
@@ -130,8 +129,7 @@ def EBA_1(clip=False):
         % cnt)
 
     logger.info("Saving EBA_1 data")
-    fileNm = os.path.join(DATA_PATH, "analysis/EBA_1.csv")
-    eba.df.to_csv(fileNm)
+    write_data(eba.df, data_file("EBA_1"))
 
     # pickle the clipping ranges to be able to reuse them in step 3
     pickle.dump(rules, open(os.path.join(
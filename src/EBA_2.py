@@ -2,7 +2,7 @@ import os
 import pandas as pd
 import numpy as np
 import logging
-from load import BA_DATA
+from load import BA_DATA, data_file, read_data, step_hours, write_data
 
 DATA_PATH = os.getenv('DATA_PATH')
 if DATA_PATH is None:
@@ -81,16 +81,17 @@ def applyFixes(eba):
     logger.debug("TEPC fixes")
     # 7h time shift for TEPC
     ba = "TEPC"
+    shift = int(round(7 / step_hours()))
     ind = eba.df.index > pd.to_datetime("2016-05-15")
     for ba2 in eba.get_trade_partners(ba):
         eba.df.loc[ind, eba.KEY["ID"] % (ba, ba2)] = eba.df.loc[
-            ind, eba.KEY["ID"] % (ba, ba2)].shift(-7).values
+            ind, eba.KEY["ID"] % (ba, ba2)].shift(-shift).values
     eba.df.loc[ind, eba.KEY["TI"] % "TEPC"] = eba.df.loc[
-        ind, eba.KEY["TI"] % "TEPC"].shift(-7).values
+        ind, eba.KEY["TI"] % "TEPC"].shift(-shift).values
     eba.df.loc[ind, eba.KEY["D"] % "TEPC"] = eba.df.loc[
-        ind, eba.KEY["D"] % "TEPC"].shift(-7).values
+        ind, eba.KEY["D"] % "TEPC"].shift(-shift).values
     eba.df.loc[ind, eba.KEY["NG"] % "TEPC"] = eba.df.loc[
-        ind, eba.KEY["NG"] % "TEPC"].shift(-7).values
+        ind, eba.KEY["NG"] % "TEPC"].shift(-shift).values
 
     # Take PNM values after May 1st
     eba = changeTrade(eba, "PNM", "TEPC", pd.to_datetime("2016-05-01"))
@@ -164,12 +165,13 @@ def applyFixes(eba):
     # shifted forward 1H
     # Assume the same needs to be done for D and NG
     ind = eba.df.index < pd.to_datetime("2016-09-13")
+    shift = int(round(1 / step_hours()))
     eba.df.loc[ind, eba.KEY["TI"] % "CISO"] = eba.df.loc[
-        ind, eba.KEY["TI"] % "CISO"].shift(-1).values
+        ind, eba.KEY["TI"] % "CISO"].shift(-shift).values
     eba.df.loc[ind, eba.KEY["D"] % "CISO"] = eba.df.loc[
-        ind, eba.KEY["D"] % "CISO"].shift(-1).values
+        ind, eba.KEY["D"] % "CISO"].shift(-shift).values
     eba.df.loc[ind, eba.KEY["NG"] % "CISO"] = eba.df.loc[
-        ind, eba.KEY["NG"] % "CISO"].shift(-1).values
+        ind, eba.KEY["NG"] % "CISO"].shift(-shift).values
 
     logger.debug("AZPS fixes")
     ba = "AZPS"
@@ -266,9 +268,8 @@ def applyFixes(eba):
     changeTrade(eba, "OVEC", "PJM", start=pd.to_datetime("2016-03-01"), end=pd.to_datetime("2016-07-01"))
 
     # Dealing with the data after 20161028 - we use the median carbon intensity for the rest of the year and carbon data
-    fileNm = os.path.join(DATA_PATH, "analysis/AMPD_2.csv")
-    co2_ovec = pd.read_csv(fileNm, index_col=0, parse_dates=['DATE_TIME_UTC'],
-                           infer_datetime_format=True, usecols=['DATE_TIME_UTC', "CO2_OVEC"])
+    co2_ovec = read_data(data_file("AMPD_2", read=True), columns=["CO2_OVEC"],
+                         infer_datetime_format=True)
     ind = eba.df.index > pd.to_datetime("20161028")
     eba.df.loc[ind, eba.get_cols(r=ba, field="NG")[0]] = (
         1.017 * co2_ovec[co2_ovec.index > pd.to_datetime("20161028")]["CO2_OVEC"])
@@ -717,5 +718,4 @@ def EBA_2():
     eba = applyFixes2(eba)
 
     logger.info("Saving EBA_2 data")
-    fileNm = os.path.join(DATA_PATH, "analysis/EBA_2.csv")
-    eba.df.to_csv(fileNm)
+    write_data(eba.df, data_file("EBA_2"))
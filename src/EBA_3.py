@@ -298,7 +298,7 @@ def standardFixes(eba):
 
 
 def egrid_adjust(eba):
-    from load import EGRID
+    from load import EGRID, step_hours, time_steps
     logger = logging.getLogger("clean")
     logger.info("\t\tEBA adjusting to match eGRID")
     egrid_ba = EGRID(sheet_name='BA16')
@@ -318,7 +318,8 @@ def egrid_adjust(eba):
 
     elec = eba.df.loc[:, eba.get_cols(eba.regions, "NG")]
     elec.columns = [col.split(".")[1].split("-")[0] for col in elec.columns]
-    elec = pd.DataFrame(elec.sum())
+    # EBA data is in MW: annual generation in MWh, as in eGRID
+    elec = pd.DataFrame(elec.sum() * step_hours())
     elec.columns = ["NGEN"]
 
     diff = ba - elec
@@ -328,7 +329,7 @@ def egrid_adjust(eba):
     for bacode in diff.index:
         if bacode not in exclude:
             eba.df.loc[:, eba.get_cols(bacode, "NG")] += diff.loc[
-                bacode, "NGEN"] / 8784
+                bacode, "NGEN"] / (len(time_steps(2016)) * step_hours())
             
     return eba
 
@@ -437,7 +438,7 @@ def EBA_3():
     '''
     What big changes can I make by hand?
     '''
-    from load import BA_DATA
+    from load import BA_DATA, data_file, write_data
     logger = logging.getLogger('clean')
     logger.info("Starting EBA_3")
 
@@ -448,9 +449,7 @@ def EBA_3():
     eba = egrid_adjust(eba)
     eba = final_adjust(eba)
 
-    for ba in eba.regions:
-        eba.checkBA(ba)
+    eba.checkAll()
 
     logger.info("Saving EBA_3 data")
-    fileNm = os.path.join(DATA_PATH, "analysis/EBA_3.csv")
-    eba.df.to_csv(fileNm)
+    write_data(eba.df, data_file("EBA_3"))
@@ -1,14 +1,25 @@
+import io
 import os
-import sys
+import shutil
 import pandas as pd
 import numpy as np
 import logging
 import time
+from joblib import Parallel, delayed, effective_n_jobs
+from load import (BA_DATA, append_data, data_file, data_parts, file_format,
+                  read_data, remove_data, replace_data, step_hours,
+                  write_data)
 
 DATA_PATH = os.getenv('DATA_PATH')
 if DATA_PATH is None:
     raise ValueError("DATA_PATH needs to be set")
 
+# Pollutants in the SEED data set - one per emissions variable in BA_DATA
+POLLS = [k for k in BA_DATA.KEYS if (k != "E") and not k.endswith("i")]
+
+# Values used to fill NAs and zeros in production emissions (per hour)
+FILL_VALUES = {"CO2": 1./100, "SO2": 1./100/1000, "NOX": 1./100/1000}
+
 
 def consumption_emissions(F, P, ID):
     '''
@@ -21,28 +32,19 @@ def consumption_emissions(F, P, ID):
         d_i: demand at node i
         t: trade matrix - t_{ij} is from node i to j
         F_i^p: emissions produced at node i
-    Note: np version must be high enough, otherwise np.linalg.cond fails
-    on a matrix with only zeros.
+    Nodes that are isolated (see isolated_nodes) make the system singular:
+    we perturb them so that the linear system makes sense.
     '''
-    from distutils.version import LooseVersion
-    assert LooseVersion(np.__version__) >= LooseVersion('1.15.1')
-
     # Create and solve linear system
     Imp = (-ID).clip(min=0)  # trade matrix reports exports - we want imports
     I_tot = Imp.sum(axis=1)  # sum over columns
     A = np.diag(P + I_tot) - Imp
     b = F
 
-    perturbed = []
-    if np.linalg.cond(A) > (1./sys.float_info.epsilon):
-        # matrix is ill-conditioned
-        for i in range(len(A)):
-            if ((np.abs(A[:, i]).sum() == 0.)
-                    & (np.abs(A[i, :]).sum() == 0.)):
-                A[i, i] = 1.  # slightly perturb that element
-                perturbed += [i]
-                # force this to be zero so the linear system makes sense
-                b[i] = 0.
+    perturbed = np.nonzero(isolated_nodes(P[np.newaxis], ID[np.newaxis])[0])[0]
+    A[perturbed, perturbed] = 1.  # slightly perturb that element
+    # force this to be zero so the linear system makes sense
+    b[perturbed] = 0.
 
     X = np.linalg.solve(A, b)
 
@@ -56,46 +58,627 @@ def consumption_emissions(F, P, ID):
     return X, len(perturbed)
 
 
-def makeSEED(poll="CO2", time_lev="H"):
+def isolated_nodes(P, ID):
     '''
-    Combine AMPD and EBA data to create the SEED data set.
-    Calculates consumption-based emissions.
+    Structural detection of the isolated nodes in the consumption emissions
+    linear systems, for all time steps at once.
+        P: (T, n) array of generation
+        ID: (T, n, n) array of interchange
+    A node is isolated if both its row and its column in the linear system
+    are entirely zero, i.e. it does not generate, import or export. These
+    nodes make the system singular. Returns a (T, n) boolean mask.
+    '''
+    Imp = (-ID).clip(min=0)
+    return _isolated(P, Imp.sum(axis=2), Imp.sum(axis=1))
+
+
+def _isolated(P, imp_row, imp_col):
+    '''
+    Same as isolated_nodes, from the row and column sums of the import
+    matrices (so that they are only computed once, see _system).
+    '''
+    diag = np.abs(P + imp_row)
+    return (diag + imp_row == 0.) & (diag + imp_col == 0.)
+
+
+def trade_arrays(df, eba):
+    '''
+    Extract generation and interchange data from a data frame with EBA columns
+    as numpy arrays, with regions in the order of eba.regions:
+        P: (T, n) array of generation
+        ID: (T, n, n) array of interchange - ID[t, i, j] is from node i to j
+    Pairs that do not trade are left at zero. If the interchange of eba is
+    stored as edges (see load_SEED_data), only the columns of df for the
+    stored edges are read (see BA_DATA.get_arrays).
+    '''
+    arrays = eba.get_arrays(fields=["NG", "ID"], df=df)
+    return arrays["NG"].astype(float), arrays["ID"]
+
+
+def trade_pattern(eba):
+    '''
+    Return the (n, n) boolean adjacency matrix of the trade network, with
+    regions in the order of eba.regions.
+    '''
+    ind = {ba: i for i, ba in enumerate(eba.regions)}
+    pattern = np.zeros((len(eba.regions), len(eba.regions)), dtype=bool)
+    for ba in eba.regions:
+        for ba2 in eba.get_trade_partners(ba):
+            pattern[ind[ba], ind[ba2]] = True
+    return pattern
+
+
+# Cache for the symbolic structure of the sparse trade systems, by pattern
+_SYMBOLIC = {}
+
+
+def _symbolic(pattern):
+    '''
+    Symbolic analysis of the sparse linear system for a given trade pattern.
+    This is done once per pattern: we compute a fill-reducing (reverse
+    Cuthill-McKee) ordering and the CSC structure of the permuted matrix.
+    Returns perm, the ordering, indices and indptr for the CSC structure, and
+    rows and cols, the positions of the stored entries in the original
+    (unpermuted) matrix.
+    '''
+    key = (pattern.shape, pattern.tobytes())
+    if key not in _SYMBOLIC:
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import reverse_cuthill_mckee
+        n = len(pattern)
+        pat = pattern | pattern.T | np.eye(n, dtype=bool)
+        perm = reverse_cuthill_mckee(csr_matrix(pat), symmetric_mode=True)
+        pat_p = pat[np.ix_(perm, perm)]
+        cols_p, rows_p = np.nonzero(pat_p.T)  # column-major order
+        indptr = np.concatenate([[0], np.cumsum(pat_p.sum(axis=0))])
+        _SYMBOLIC[key] = (perm, rows_p, indptr, perm[rows_p], perm[cols_p])
+    return _SYMBOLIC[key]
+
+
+def _solve_sparse(A_data, b, pattern):
+    '''
+    Solve the stacked sparse systems, reusing the symbolic structure of the
+    pattern. A_data is a (T, nnz) array with the values of A at the positions
+    returned by _symbolic. Time steps for which the system is singular are
+    left as NaN. Also returns the solve time for each time step.
+    '''
+    from scipy.sparse import csc_matrix
+    from scipy.sparse.linalg import splu
+    perm, indices, indptr, _, _ = _symbolic(pattern)
+    n = len(pattern)
+    X = np.full(b.shape, np.nan)
+    times = np.zeros(len(b))
+    for t in range(len(b)):
+        start_time = time.time()
+        A = csc_matrix((A_data[t], indices, indptr), shape=(n, n))
+        try:
+            # The ordering is already applied - keep pivots on the diagonal
+            lu = splu(A, permc_spec="NATURAL", diag_pivot_thresh=0.)
+            X[t, perm] = lu.solve(b[t, perm])
+        except RuntimeError:  # exactly singular
+            pass
+        times[t] = time.time() - start_time
+    return X, times
+
+
+# Cache for the block decomposition of the trade network, by pattern
+_BLOCKS = {}
+
+
+def trade_blocks(pattern):
+    '''
+    Decompose the trade network into independent blocks: the connected
+    components of the trade pattern (e.g. the Eastern, Western and ERCOT
+    interconnections). Nodes that do not trade at all are grouped in a single
+    block, for which the linear system is diagonal. The decomposition is
+    cached and only recomputed if the pattern changes.
+    Returns a list of index arrays, one per block.
+    '''
+    key = (pattern.shape, pattern.tobytes())
+    if key not in _BLOCKS:
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import connected_components
+        ncomp, labels = connected_components(
+            csr_matrix(pattern | pattern.T), directed=False)
+        blocks = [np.nonzero(labels == c)[0] for c in range(ncomp)]
+        singles = [b for b in blocks if len(b) == 1]
+        blocks = [b for b in blocks if len(b) > 1]
+        if len(singles) > 0:
+            blocks += [np.concatenate(singles)]
+        _BLOCKS[key] = blocks
+    return _BLOCKS[key]
+
+
+# Cache for the leaf eliminations in the trade network, by pattern
+_REDUCTIONS = {}
+
+
+def trade_reduction(pattern):
+    '''
+    Find the nodes of the trade network that can be eliminated before
+    solving: leaf nodes (with a single trade partner) are eliminated one at a
+    time, which can make their partner a leaf in turn, so that radial chains
+    and trees are eliminated entirely. The elimination order is cached and
+    only recomputed if the pattern changes.
+    Returns the eliminated nodes (in order), their partners at the time of
+    elimination, and the nodes in the core system.
+    '''
+    key = (pattern.shape, pattern.tobytes())
+    if key not in _REDUCTIONS:
+        n = len(pattern)
+        pat = (pattern | pattern.T) & ~np.eye(n, dtype=bool)
+        deg = pat.sum(axis=1)
+        active = np.ones(n, dtype=bool)
+        leaves = [i for i in range(n) if deg[i] == 1]
+        order, parent = [], []
+        while len(leaves) > 0:
+            leaf = leaves.pop(0)
+            if deg[leaf] != 1:  # partner was eliminated first
+                continue
+            p = np.nonzero(pat[leaf] & active)[0][0]
+            order += [leaf]
+            parent += [p]
+            active[leaf] = False
+            deg[leaf] -= 1
+            deg[p] -= 1
+            if deg[p] == 1:
+                leaves += [p]
+        _REDUCTIONS[key] = (np.array(order, dtype=int),
+                            np.array(parent, dtype=int),
+                            np.nonzero(active)[0])
+    return _REDUCTIONS[key]
+
+
+def _solve_iterative(diag, Imp, b, tol=1e-10, max_iter=100):
+    '''
+    Solve the stacked systems diag(diag) - Imp with Gauss-Seidel iterations,
+    one time step after the other. Each time step is warm-started from the
+    solution for the previous time step, since consecutive hours have similar
+    solutions. Iterations stop when the relative residual
+        max|b - A x| / max|b|
+    is below tol; time steps that have not converged after max_iter
+    iterations are solved directly.
+    Returns X, the number of iterations for each time step, a boolean array
+    indicating the time steps for which we fell back to the direct solve,
+    and the solve time for each time step.
+    '''
+    from scipy.linalg import solve_triangular
+    T, n = diag.shape
+    idx = np.arange(n)
+    X = np.full(b.shape, np.nan)
+    iters = np.zeros(T, dtype=int)
+    fallback = np.zeros(T, dtype=bool)
+    times = np.zeros(T)
+    x = np.zeros(b.shape[1:])
+    for t in range(T):
+        start_time = time.time()
+        A = -Imp[t]
+        A[idx, idx] += diag[t]
+        M = np.tril(A)  # Gauss-Seidel splitting: A = M - N
+        N = np.triu(Imp[t], k=1)
+        bnorm = np.abs(b[t]).max()
+        converged = False
+        try:
+            for k in range(max_iter):
+                if np.abs(b[t] - A.dot(x)).max() <= tol * bnorm:
+                    converged = True
+                    break
+                x = solve_triangular(M, b[t] + N.dot(x), lower=True)
+                iters[t] += 1
+        except (np.linalg.LinAlgError, ValueError):
+            pass
+        if not converged:
+            fallback[t] = True
+            try:
+                x = np.linalg.solve(A, b[t])
+            except np.linalg.LinAlgError:
+                x = np.zeros(b.shape[1:])  # restart from zero next time
+                times[t] = time.time() - start_time
+                continue
+        X[t] = x
+        times[t] = time.time() - start_time
+    return X, iters, fallback, times
+
+
+def _solve_dense(A, b):
+    '''
+    Solve the stacked dense systems A X = b, factorizing each matrix once.
+    If one of the systems is singular, the singular time steps are found
+    from the signs of the determinants (which are 0 exactly when solve fails,
+    as both use the same LU factorization), the other time steps are solved
+    again in one batch, and the singular ones are left as NaN.
+    '''
+    try:
+        return np.linalg.solve(A, b)
+    except np.linalg.LinAlgError:
+        ok = np.linalg.slogdet(A)[0] != 0.
+        X = np.full(b.shape, np.nan)
+        X[ok] = np.linalg.solve(A[ok], b[ok])
+        return X
+
+
+def _solve(diag, Imp, b, pattern, backend, info=None, tol=1e-10,
+           max_iter=100):
+    '''
+    Solve the stacked systems with matrix diag(diag) - Imp and right-hand
+    sides b (T, n, k) with the given backend. Time steps for which the system
+    is singular are left as NaN. If info is a dict, the solve time for each
+    time step is stored in it (for the dense backend, which solves all time
+    steps at once, this is the average), as well as the iteration counts and
+    fallbacks for the iterative backend.
+    '''
+    start_time = time.time()
+    n = diag.shape[1]
+    idx = np.arange(n)
+    if backend == "dense":
+        A = -Imp
+        A[:, idx, idx] += diag
+        X = _solve_dense(A, b)
+    elif backend == "sparse":
+        _, _, _, rows, cols = _symbolic(pattern)
+        A_data = np.ascontiguousarray(-Imp[:, rows, cols])
+        on_diag = rows == cols
+        A_data[:, on_diag] = diag[:, rows[on_diag]]
+        X, times = _solve_sparse(A_data, b, pattern)
+    elif backend == "iterative":
+        X, iters, fallback, times = _solve_iterative(
+            diag, Imp, b, tol=tol, max_iter=max_iter)
+        if info is not None:
+            info["iterations"] = iters
+            info["fallback"] = fallback
+    else:
+        raise ValueError("Unknown backend %s" % backend)
+    if info is not None:
+        if backend == "dense":
+            times = np.full(len(b), (time.time() - start_time) / len(b))
+        info["solve_time"] = times
+    return X
+
+
+def _solve_reduced(diag, Imp, b, pattern, backend, **kwargs):
+    '''
+    Same as _solve, but eliminate the leaf nodes of the trade network first
+    (see trade_reduction), solve the core system and back-substitute. For a
+    leaf l with partner p, eliminating l is one step of Gaussian elimination:
+        a_pp <- a_pp - Imp_pl * Imp_lp / a_ll
+        b_p <- b_p + Imp_pl * b_l / a_ll
+    and once x_p is known, x_l = (b_l + Imp_lp * x_p) / a_ll.
+    '''
+    order, parent, core = trade_reduction(pattern)
+    diag = diag.copy()
+    b = b.copy()
+    singular = np.zeros(len(b), dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for l, p in zip(order, parent):
+            singular |= diag[:, l] == 0.
+            r = Imp[:, p, l] / diag[:, l]
+            diag[:, p] -= r * Imp[:, l, p]
+            b[:, p] += r[:, np.newaxis] * b[:, l]
+
+        X = np.full(b.shape, np.nan)
+        X[:, core] = _solve(diag[:, core], Imp[:, core][:, :, core],
+                            b[:, core], pattern[np.ix_(core, core)], backend,
+                            **kwargs)
+        for l, p in zip(order[::-1], parent[::-1]):
+            X[:, l] = (b[:, l] + Imp[:, l, p, np.newaxis] * X[:, p]) / diag[
+                :, l, np.newaxis]
+    X[singular] = np.nan
+    return X
+
+
+# One row per time step in the solver diagnostics
+DIAGNOSTICS_DTYPE = np.dtype([
+    ("cond_bound", np.float32), ("residual", np.float32),
+    ("perturbed", np.int16), ("iterations", np.int16),
+    ("fallback", np.bool_), ("singular", np.bool_),
+    ("solve_time", np.float32)])
+
+
+def _system(F, P, ID):
+    '''
+    Create the stacked linear systems for consumption_emissions_batch, and
+    perturb isolated nodes. Returns diag (T, n) and Imp (T, n, n), the matrix
+    being diag(diag) - Imp, the right-hand sides b (T, n, k), and the (T, n)
+    mask of perturbed nodes.
+    '''
+    Imp = (-ID).clip(min=0)  # trade matrix reports exports - we want imports
+    imp_row = Imp.sum(axis=2)
+    diag = P + imp_row
+    b = np.array(F, dtype=float)
+    if b.ndim == 2:
+        b = b[:, :, np.newaxis]
+
+    # Perturb isolated nodes
+    perturbed = _isolated(P, imp_row, Imp.sum(axis=1))
+    diag[perturbed] = 1.
+    b[perturbed] = 0.
+    return diag, Imp, b, perturbed
+
+
+def _diagnostics(diag, Imp, b, X, perturbed, info):
+    '''
+    Collect the solver diagnostics in a structured array with one row per
+    time step (see DIAGNOSTICS_DTYPE):
+        cond_bound: upper bound on the infinity-norm condition number. The
+            systems are row diagonally dominant, so that (Varah's bound)
+            cond(A) <= ||A|| / min_i (|a_ii| - sum_j |a_ij|)
+            This is infinite if one of the rows is not strictly dominant.
+        residual: relative residual max|b - A x| / max|b|
+        perturbed: number of perturbed nodes
+        iterations, fallback: for the iterative backend (0 and False
+            otherwise)
+        singular: whether the system was singular (the solution is NaN)
+        solve_time: time spent solving, in seconds
+    These only cost a few operations per matrix entry.
+    '''
+    T = len(diag)
+    diagnostics = np.zeros(T, dtype=DIAGNOSTICS_DTYPE)
+    off = Imp.sum(axis=2)
+    margin = (np.abs(diag) - off).min(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diagnostics["cond_bound"] = np.where(
+            margin > 0., (np.abs(diag) + off).max(axis=1) / margin, np.inf)
+        r = b - (diag[:, :, np.newaxis] * X - np.matmul(Imp, X))
+        diagnostics["residual"] = (np.abs(r).max(axis=(1, 2))
+                                   / np.abs(b).max(axis=(1, 2)))
+    diagnostics["perturbed"] = perturbed.sum(axis=1)
+    diagnostics["singular"] = np.isnan(X).any(axis=(1, 2))
+    if "iterations" in info:
+        diagnostics["iterations"] = info["iterations"]
+        diagnostics["fallback"] = info["fallback"]
+    if "solve_time" in info:
+        diagnostics["solve_time"] = info["solve_time"]
+    return diagnostics
+
+
+# Default number of time steps in the shards solved in parallel
+SHARD_SIZE = 256
+
+
+def _solve_part(F, P, ID, info, **kwargs):
+    '''
+    Solve a shard of time steps or a block of the trade network with
+    consumption_emissions_batch. The workers may run in separate processes,
+    so the solver information is returned with X and perturbed.
+    '''
+    X, perturbed = consumption_emissions_batch(F, P, ID, info=info, **kwargs)
+    return X, perturbed, info
+
+
+def _prefer(backend):
+    '''
+    Type of joblib workers for backend: threads for the dense backend, for
+    which LAPACK releases the GIL, and processes otherwise, as the sparse
+    and iterative backends spend much of their time in Python.
+    '''
+    return "threads" if backend == "dense" else "processes"
+
+
+def _merge_shards(infos):
+    '''
+    Concatenate the solver information for consecutive time shards.
+    '''
+    info = {}
+    for key in ["solve_time", "iterations", "fallback", "diagnostics"]:
+        if key in infos[0]:
+            info[key] = np.concatenate([info_s[key] for info_s in infos])
+    return info
+
+
+def _merge_blocks(infos):
+    '''
+    Combine the solver information for the independent blocks of the trade
+    network. The solve times and the numbers of perturbed nodes add up, the
+    iterations are the largest over the blocks, and a time step is singular
+    or fell back to a direct solve if one of its blocks did. The condition
+    bound and the relative residual are the largest over the blocks, which
+    are solved separately.
+    '''
+    info = {"solve_time": np.sum(
+        [info_b["solve_time"] for info_b in infos], axis=0)}
+    if "iterations" in infos[0]:
+        info["iterations"] = np.max(
+            [info_b["iterations"] for info_b in infos], axis=0)
+        info["fallback"] = np.any(
+            [info_b["fallback"] for info_b in infos], axis=0)
+    diags = [info_b["diagnostics"] for info_b in infos]
+    diagnostics = np.zeros(len(diags[0]), dtype=DIAGNOSTICS_DTYPE)
+    for key in ["cond_bound", "iterations"]:
+        diagnostics[key] = np.max([d[key] for d in diags], axis=0)
+    # The residual is NaN for blocks of perturbed nodes, for which b is 0
+    diagnostics["residual"] = np.fmax.reduce([d["residual"] for d in diags])
+    for key in ["fallback", "singular"]:
+        diagnostics[key] = np.any([d[key] for d in diags], axis=0)
+    for key in ["perturbed", "solve_time"]:
+        diagnostics[key] = np.sum([d[key] for d in diags], axis=0)
+    info["diagnostics"] = diagnostics
+    return info
+
+
+def consumption_emissions_batch(F, P, ID, backend="dense", pattern=None,
+                                blocks=False, n_jobs=1, reduce=False,
+                                info=None, shard_size=None, **kwargs):
+    '''
+    Batched version of consumption_emissions: solve the linear system for all
+    time steps at once.
+        F: (T, n) array of emissions produced, or (T, n, k) array to solve
+            for k pollutants at once (the system is factorized once)
+        P: (T, n) array of generation
+        ID: (T, n, n) array of interchange
+        backend: "dense" to solve all systems in one stacked np.linalg.solve
+            call, "sparse" to use sparse LU factorizations that reuse the
+            symbolic analysis of the trade pattern across time steps, or
+            "iterative" to use warm-started Gauss-Seidel iterations (see
+            _solve_iterative)
+        pattern: (n, n) boolean adjacency matrix of the trade network (see
+            trade_pattern), used by the sparse backend. If None, this is
+            inferred from the non-zero entries in ID.
+        blocks: if True, split the system into independent blocks (see
+            trade_blocks) and solve them separately - in parallel if n_jobs is
+            not 1. If the system for one block is singular, the whole time
+            step is set to NaN, as for the full system. The diagnostics are
+            combined from those of the blocks (see _merge_blocks). With a
+            single block, the system is solved as a whole.
+        n_jobs: number of workers - threads for the dense backend, and
+            processes for the others (see _prefer). Without blocks, the time
+            axis is split in shards of shard_size time steps (by default
+            SHARD_SIZE) that are solved in parallel, also if shard_size is
+            given with n_jobs equal to 1. Shards do not depend on n_jobs, so
+            neither do the results (the iterative backend restarts its warm
+            starts at the start of each shard).
+        reduce: if True, eliminate leaf nodes and radial chains before
+            solving the smaller core system (see trade_reduction)
+        info: optional dict, in which the iterative backend stores the
+            number of iterations for each time step ("iterations") and the
+            time steps for which it fell back to a direct solve ("fallback").
+            The per time step diagnostics are
+            stored as "diagnostics" (see _diagnostics) and the solve times as
+            "solve_time".
+    Other keyword arguments are backend options:
+        tol, max_iter: tolerance on the relative residual and maximum number
+            of iterations for the iterative backend (1e-10 and 100)
+    Returns X, the array of consumption emissions intensities (same shape as
+    F), and the (T, n) boolean mask of perturbed nodes. As in
+    consumption_emissions, isolated nodes are perturbed, and time steps for
+    which the system is singular are set to NaN.
+    '''
+    T, n = P.shape
+    if pattern is None:
+        pattern = (ID != 0.).any(axis=0)
+    if blocks:
+        blocks = trade_blocks(pattern)
+        if len(blocks) == 1:
+            blocks = False
+
+    if (not blocks) and ((effective_n_jobs(n_jobs) > 1) or (
+            shard_size is not None)) and (T > (shard_size or SHARD_SIZE)):
+        if shard_size is None:
+            shard_size = SHARD_SIZE
+        shards = [slice(start, min(start + shard_size, T))
+                  for start in range(0, T, shard_size)]
+        res = Parallel(n_jobs=n_jobs, prefer=_prefer(backend))(
+            delayed(_solve_part)(
+                F[sl], P[sl], ID[sl], None if info is None else {},
+                backend=backend, pattern=pattern, reduce=reduce, **kwargs)
+            for sl in shards)
+        X = np.concatenate([X_s for X_s, _, _ in res])
+        perturbed = np.concatenate([pert_s for _, pert_s, _ in res])
+        if info is not None:
+            info.update(_merge_shards([info_s for _, _, info_s in res]))
+        return X, perturbed
+
+    if blocks:
+        res = Parallel(n_jobs=n_jobs, prefer=_prefer(backend))(
+            delayed(_solve_part)(
+                F[:, ib], P[:, ib], ID[:, ib][:, :, ib],
+                None if info is None else {}, backend=backend,
+                pattern=pattern[np.ix_(ib, ib)], reduce=reduce, **kwargs)
+            for ib in blocks)
+        X = np.full(np.shape(F), np.nan)
+        perturbed = np.zeros((T, n), dtype=bool)
+        for ib, (X_b, pert_b, _) in zip(blocks, res):
+            X[:, ib] = X_b
+            perturbed[:, ib] = pert_b
+        X[np.isnan(X).reshape((T, -1)).any(axis=1)] = np.nan
+        if info is not None:
+            info.update(_merge_blocks([info_b for _, _, info_b in res]))
+        return X, perturbed
+
+    diag, Imp, b, perturbed = _system(F, P, ID)
+    if reduce:
+        X = _solve_reduced(diag, Imp, b, pattern, backend, info=info,
+                           **kwargs)
+    else:
+        X = _solve(diag, Imp, b, pattern, backend, info=info, **kwargs)
+    ok = ~np.isnan(X).any(axis=(1, 2))
+
+    check = (X != 0.).any(axis=2) & perturbed & ok[:, np.newaxis]
+    if check.any():
+        it, ii = np.nonzero(check)
+        raise ValueError("X[%d] is %.2f instead of 0 at time step %d" % (
+            ii[0], np.abs(X[it[0], ii[0]]).max(), it[0]))
+
+    if info is not None:
+        info["diagnostics"] = _diagnostics(diag, Imp, b, X, perturbed, info)
+
+    return X.reshape(np.shape(F)), perturbed
+
+
+# Cache for the merged inputs, keyed by the pollutants and the modification
+# times of the input files
+_SEED_DATA = {}
+
+
+def load_SEED_data(polls=None, cache=True, fill=True):
+    '''
+    Load and merge AMPD and EBA data for the pollutants in polls, and fill
+    NAs and zeros. Returns the merged data frame and the EBA data object, so
+    that the inputs can be loaded once and used for several calls to makeSEED.
+    If cache is True, the merged inputs are cached, and re-used as long as
+    the input files do not change (also for subsets of the pollutants):
+    entries for older versions of the input files are evicted. The cached
+    data frame should not be modified. If fill is False, NAs and zeros are
+    kept (see fill_SEED_data), and the merged inputs are not cached.
     '''
-    from load import BA_DATA
     logger = logging.getLogger('clean')
-    logger.info("Starting SEED - %s - %s" % (poll, time_lev))
+    if polls is None:
+        polls = POLLS
+    if isinstance(polls, str):
+        polls = [polls]
+
+    fileNm = data_file("AMPD_2", read=True)
+    mtimes = (os.path.getmtime(fileNm), os.path.getmtime(
+        data_file("EBA_3", read=True)))
+    cache = cache and fill
+    if cache:
+        for (polls_c, mtimes_c), data in _SEED_DATA.items():
+            if (mtimes_c == mtimes) and set(polls) <= set(polls_c):
+                logger.debug("Using cached SEED data - %s" % ", ".join(
+                    polls_c))
+                return data
+    logger.info("Loading SEED data - %s" % ", ".join(polls))
 
     # Load AMPD data
-    fileNm = os.path.join(DATA_PATH, "analysis/AMPD_2.csv")
-    ampd_ba_p = pd.read_csv(fileNm, index_col=0, parse_dates=['DATE_TIME_UTC'],
-                            infer_datetime_format=True)
-
-    # Load EBA data
-    eba = BA_DATA(step=3)
-    
-    # Select the pollutant
-    cols = [col for col in ampd_ba_p.columns if poll in col]
+    ampd_ba_p = read_data(fileNm, infer_datetime_format=True)
+
+    # Load EBA data - interchange is kept as edges in eba, so that each pair
+    # of antisymmetric columns is only read once to build the trade arrays
+    eba = BA_DATA(step=3, edges=True)
+
+    # Select the pollutants
+    cols = [col for col in ampd_ba_p.columns if col.split("_")[0] in polls]
     df_poll = ampd_ba_p.loc[:, cols].copy(deep=True)
     df_poll.columns = [col+"_NG" for col in df_poll.columns]
     # Merge dataframes
-    df_j = df_poll.join(eba.df, how='inner')
-
+    df_j = df_poll.join(eba.get_frame(), how='inner')
 
     # Drop the extra BAs
-    df_j = df_j.drop(["%s_%s_NG" % (poll, ba) for ba in
+    df_j = df_j.drop(["%s_%s_NG" % (poll, ba) for poll in polls for ba in
                       ['AMPL', 'HECO', 'GRIS', 'CEA']], axis=1)
-    
-    # Fill NAs and zeros
+
+    if fill:
+        df_j = fill_SEED_data(df_j, polls)
+
+    if cache:
+        # Evict the entries for older versions of the input files
+        for key in [key for key in _SEED_DATA if key[1] != mtimes]:
+            del _SEED_DATA[key]
+        _SEED_DATA[(tuple(polls), mtimes)] = (df_j, eba)
+    return df_j, eba
+
+
+def fill_SEED_data(df_j, polls):
+    '''
+    Fill NAs and zeros in the merged inputs df_j (see load_SEED_data) for the
+    pollutants in polls. df_j is modified in place and returned.
+    '''
+    logger = logging.getLogger('clean')
     for col in df_j.columns:
-        if "CO2" in col:
-            df_j[col] = df_j[col].fillna(1./100)
-            df_j.loc[(df_j[col] == 0.), col] = 1./100
-        elif "SO2" in col:
-            df_j[col] = df_j[col].fillna(1./100/1000)
-            df_j.loc[(df_j[col] == 0.), col] = 1./100/1000
-        elif "NOX" in col:
-            df_j[col] = df_j[col].fillna(1./100/1000)
-            df_j.loc[(df_j[col] == 0.), col] = 1./100/1000
+        if col.split("_")[0] in polls:
+            fill_value = FILL_VALUES.get(col.split("_")[0], 1./100/1000) * (
+                step_hours())
+            df_j[col] = df_j[col].fillna(fill_value)
+            df_j.loc[(df_j[col] == 0.), col] = fill_value
         elif "-ALL.D.H" in col:
             df_j[col] = df_j[col].fillna(1.)
             df_j.loc[df_j[col] == 0., col] = 1.
@@ -108,95 +691,440 @@ def makeSEED(poll="CO2", time_lev="H"):
             df_j[col] = df_j[col].fillna(0.)
         else:
             logger.warn("Unexpected column %s" % col)
-         
-    # allocate space for the consumption emissions (speeds up what's next)
-    newcols = (df_j.columns.tolist()
-               + ["%si_%s_D" % (poll, ba) for ba in eba.regions])
-    df_j = df_j.reindex(columns=newcols)
-    
-    # Aggregate to month, year, or do nothing to stay at hour
-    if time_lev == "M":
-        df_j = df_j.groupby(df_j.index.month).sum()
-    elif time_lev == "Y":
-        df_j = df_j.groupby(df_j.index.year).sum()
-
-    def apply_consumption_calc(row, poll):
-        '''
-        Extract data for a row in the dataframe with EBA and AMPD data and call
-        the consumption emissions function
-        '''
-        P = row[[eba.KEY['NG'] % r for r in eba.regions]].values
-        ID = np.zeros((len(eba.regions), len(eba.regions)))
-        for i, ri in enumerate(eba.regions):
-            for j, rj in enumerate(eba.regions):
-                if eba.KEY['ID'] % (ri, rj) in eba.df.columns:
-                    ID[i][j] = row[eba.KEY['ID'] % (ri, rj)]
-
-        F = row[[("%s_%s_NG") % (poll, ba) for ba in eba.regions]].values
-        X = [np.nan for ba in eba.regions]
-        try:
-            X, pert = consumption_emissions(F, P, ID)
-        except np.linalg.LinAlgError:
-            pass
-        except ValueError:
-            raise
-        row[[("%si_%s_D") % (poll, ba) for ba in eba.regions]] = X
-        return row
+    return df_j
+
+
+def time_groups(index, rule):
+    '''
+    Return the keys to group the time steps in index by, for aggregation
+    rule rule (see aggregate_time).
+    '''
+    if isinstance(rule, str):
+        if rule == "M":
+            return index.month
+        elif rule == "Y":
+            return index.year
+        return pd.Grouper(freq=rule)
+    elif callable(rule):
+        return rule(index)
+    elif isinstance(rule, tuple):
+        return [getattr(index, attr) for attr in rule]
+    return rule
+
+
+def aggregate_time(df_j, rule):
+    '''
+    Aggregate the merged SEED data frame in time. rule can be:
+        "H" to stay at hour
+        "M" or "Y" to aggregate by month (of the year) or by year
+        any other pandas offset alias (e.g. "D", "W", "MS") to resample
+        a tuple of attributes of the time index, e.g. ("month", "hour") to
+            aggregate by hour of day and month
+        a function, called with the time index, that returns the group of
+            each time step
+        an array of group labels, e.g. custom billing periods
+    Groups defined by several keys are labeled by joining the keys with "-".
+    Electricity is in MW at the time step of the data: it is aggregated in
+    MWh, as emissions are (see row_hours).
+    '''
+    if isinstance(rule, str) and (rule == "H"):
+        return df_j
+    df_j = df_j.groupby(time_groups(df_j.index, rule)).sum()
+    if isinstance(df_j.index, pd.MultiIndex):
+        df_j.index = ["-".join([str(k) for k in key]) for key in df_j.index]
+    if step_hours() != 1.:
+        elec = [col for col in df_j.columns if col.startswith("EBA.")]
+        df_j.loc[:, elec] = df_j.loc[:, elec] * step_hours()
+    return df_j
+
 
+def row_hours(rule):
+    '''
+    Return the length in hours of the rows of the merged SEED data frame
+    aggregated with rule (see aggregate_time), to express intensities in
+    kg/MWh: the time step of the data for "H", and 1 otherwise, as
+    aggregated electricity is in MWh.
+    '''
+    if isinstance(rule, str) and (rule == "H"):
+        return step_hours()
+    return 1.
+
+
+def _csv_offset(fileNm, start):
+    '''
+    Return the byte offset of the first row of csv file fileNm with an index
+    greater than or equal to start. Rows are sorted by index, so the file is
+    read backwards from the end, one block at a time, until an earlier row is
+    found: the cost does not depend on the size of the file.
+    '''
+    start = pd.Timestamp(start)
+    with open(fileNm, "rb") as fr:
+        fr.seek(0, os.SEEK_END)
+        pos = end = fr.tell()
+        buf = b""
+        n_checked = 0
+        while pos > 0:
+            step = min(1 << 16, pos)
+            pos -= step
+            fr.seek(pos)
+            buf = fr.read(step) + buf
+            lines = buf.split(b"\n")
+            starts = pos + np.cumsum([0] + [len(line) + 1 for line in lines])
+            # The first line is the header, or may be incomplete
+            for k in range(len(lines) - 1 - n_checked, 0, -1):
+                n_checked += 1
+                if not lines[k].strip():
+                    continue
+                ts = pd.Timestamp(lines[k].split(b",")[0].decode())
+                if ts < start:
+                    return min(starts[k + 1], end)
+    return starts[1]
+
+
+def _last_index(fileNm):
+    '''
+    Return the index of the last row of data file fileNm. Only the end of
+    csv files is read.
+    '''
+    if file_format(fileNm) != "csv":
+        return read_data(data_parts(fileNm)[-1], columns=[]).index[-1]
+    with open(fileNm, "rb") as fr:
+        fr.seek(0, os.SEEK_END)
+        fr.seek(max(fr.tell() - (1 << 16), 0))
+        last = fr.read().strip().split(b"\n")[-1]
+    return pd.Timestamp(last.split(b",")[0].decode())
+
+
+def read_from(fileNm, start):
+    '''
+    Return the rows of data file fileNm with a time index from start onward.
+    Only the end of csv files (see _csv_offset) and the last parts of
+    partitioned data sets are read.
+    '''
+    start = pd.Timestamp(start)
+    if file_format(fileNm) == "csv":
+        with open(fileNm, "rb") as fr:
+            header = fr.readline()
+            fr.seek(_csv_offset(fileNm, start))
+            return pd.read_csv(io.BytesIO(header + fr.read()), index_col=0,
+                               parse_dates=True)
+    parts = data_parts(fileNm)
+    k = len(parts) - 1
+    while k > 0 and read_data(parts[k], columns=[]).index[0] > start:
+        k -= 1
+    df = pd.concat([read_data(part) for part in parts[k:]])
+    return df[df.index >= start]
+
+
+def save_SEED(df, fileNm, time_lev="H", update_from=None, append=False,
+              commit=True):
+    '''
+    Save SEED output df in data file fileNm. If update_from is not None and
+    the file exists, the file is updated instead: for hourly data, the rows
+    from the first time step of df onward are replaced by df (rows before
+    that are copied without being parsed), and for monthly or yearly data
+    the rows for the periods in df are replaced. The new file is written
+    to a temporary file first, and then moved in place if commit is True,
+    so that the update is atomic. If append is True, the rows of df are
+    appended to the temporary file of a previous call with commit=False:
+    outputs saved in chunks are only moved in place with the last chunk.
+    Appends and hourly updates only write the new rows: csv files are
+    appended to, and binary files are saved as partitioned data sets (see
+    load.append_data), in which the parts before the update are kept.
+    Monthly and yearly binary files are read and written again.
+    '''
+    csv = file_format(fileNm) == "csv"
+    # Keep the extension, so that the format is detected
+    fileNm_tmp = fileNm + ".tmp" + os.path.splitext(fileNm)[1]
+    if append:
+        append_data(df, fileNm_tmp)
+    elif (update_from is None) or (not os.path.exists(fileNm)):
+        write_data(df, fileNm_tmp)
+    elif (time_lev == "H") and csv:
+        with open(fileNm, "r") as fr:
+            header = fr.readline()
+        if header != df.head(0).to_csv():
+            raise ValueError("Columns in %s do not match the update" % fileNm)
+        offset = _csv_offset(fileNm, df.index[0])
+        with open(fileNm, "rb") as fr, open(fileNm_tmp, "wb") as fw:
+            while offset > 0:
+                chunk = fr.read(min(1 << 20, offset))
+                fw.write(chunk)
+                offset -= len(chunk)
+        df.to_csv(fileNm_tmp, mode="a", header=False)
+    elif time_lev == "H":
+        _keep_parts(fileNm, fileNm_tmp, df)
+        append_data(df, fileNm_tmp)
+    else:
+        df_old = read_data(fileNm, parse_dates=isinstance(
+            df.index, pd.DatetimeIndex))
+        if list(df_old.columns) != list(df.columns):
+            raise ValueError("Columns in %s do not match the update" % fileNm)
+        # Keep the order of the groups (see aggregate_time): the rows for
+        # the periods in df are replaced, and new periods are appended
+        index = df_old.index.append(df.index[~df.index.isin(df_old.index)])
+        df_old = df_old.drop(df.index, errors="ignore")
+        write_data(pd.concat([df_old, df]).reindex(index), fileNm_tmp)
+    if commit:
+        replace_data(fileNm_tmp, fileNm)
+
+
+def _keep_parts(fileNm, fileNm_tmp, df):
+    '''
+    Start the hourly update of binary SEED output fileNm with df: the rows
+    before the first time step of df are saved in the partitioned data set
+    fileNm_tmp. Parts of fileNm with only earlier rows are linked (or copied)
+    without being read, and the part with the first time step of df is
+    truncated.
+    '''
+    remove_data(fileNm_tmp)
+    os.makedirs(fileNm_tmp)
+    ext = os.path.splitext(fileNm)[1]
+    parts = data_parts(fileNm)
+    for k, part in enumerate(parts):
+        fileNm_part = os.path.join(fileNm_tmp, "part_%05d%s" % (k, ext))
+        if (k < len(parts) - 1) and (
+                read_data(part, columns=[]).index[-1] < df.index[0]):
+            try:
+                os.link(part, fileNm_part)
+            except OSError:
+                shutil.copyfile(part, fileNm_part)
+            continue
+        df_old = read_data(part)
+        if list(df_old.columns) != list(df.columns):
+            raise ValueError("Columns in %s do not match the update" % fileNm)
+        df_old = df_old[df_old.index < df.index[0]]
+        if len(df_old) > 0:
+            write_data(df_old, fileNm_part)
+        break
+
+
+def _SEED_chunk(df_j, eba, polls, time_lev, update_from=None, append=False,
+                commit=True, hours=None, **kwargs):
+    '''
+    Calculate consumption emissions for the merged (and aggregated) data
+    frame df_j and save the results for time level time_lev (see makeSEED and
+    save_SEED). hours is the length of the rows of df_j (see row_hours).
+    '''
+    logger = logging.getLogger('clean')
     logger.debug("Calculating consumption emissions...")
     start_time = time.time()
-    df_j = df_j.apply(lambda x: apply_consumption_calc(x, poll), axis=1)
+    P, ID = trade_arrays(df_j, eba)
+    F = np.stack([df_j.loc[:, ["%s_%s_NG" % (poll, ba) for ba in eba.regions]]
+                  .values for poll in polls], axis=-1)
+    pattern = trade_pattern(eba)
+    if kwargs.get("reduce", False):
+        logger.debug("Eliminating %d leaf nodes, %d nodes in the core" % (
+            len(trade_reduction(pattern)[0]), len(trade_reduction(pattern)[2])))
+    if kwargs.get("blocks", False):
+        logger.debug("Solving %d blocks of sizes %s" % (
+            len(trade_blocks(pattern)),
+            ", ".join([str(len(ib)) for ib in trade_blocks(pattern)])))
+    info = {}
+    X, pert = consumption_emissions_batch(F, P, ID, pattern=pattern,
+                                          info=info, **kwargs)
     end_time = time.time()
     logger.debug("Elapsed time was %g seconds" % (end_time - start_time))
+    logger.debug("%d perturbed nodes, %d singular time steps" % (
+        pert.sum(), np.isnan(X).any(axis=(1, 2)).sum()))
+    if info["diagnostics"]["singular"].any():
+        logger.warning("%d singular time steps: consumption emissions are NaN"
+                       % info["diagnostics"]["singular"].sum())
+    fileNm = data_file("SEED_diag_%s" % time_lev)
+    save_SEED(pd.DataFrame(info["diagnostics"], index=df_j.index), fileNm,
+              time_lev, update_from, append, commit)
+    if "iterations" in info:
+        logger.debug("Iterations: mean %.1f, max %d, %d direct solves" % (
+            info["iterations"].mean(), info["iterations"].max(),
+            info["fallback"].sum()))
 
-    # Create columns for consumption
-    for ba in eba.regions:
-        df_j.loc[:, "%s_%s_D" % (poll, ba)] = df_j.loc[:, "%si_%s_D" % (poll, ba)] * df_j.loc[
-            :, eba.get_cols(r=ba, field="D")[0]]
-
-    # Create columns for pairwise trade
-    for ba in eba.regions:
-        for ba2 in eba.get_trade_partners(ba):
-            imp = df_j.loc[:, eba.KEY["ID"] % (ba,ba2)].apply(lambda x: min(x, 0))
-            exp = df_j.loc[:, eba.KEY["ID"] % (ba,ba2)].apply(lambda x: max(x, 0))
-            df_j.loc[:, "%s_%s-%s_ID" % (poll, ba, ba2)] = (
-                imp * df_j.loc[:, "%si_%s_D" % (poll, ba2)]
-                + exp * df_j.loc[:, "%si_%s_D" % (poll, ba)])
-
-    # Create columns for total trade
-    for ba in eba.regions:
-        df_j.loc[:, "%s_%s_TI" % (poll, ba)] = df_j.loc[:, [
-                "%s_%s-%s_ID" % (poll, ba, ba2) for ba2 in
-                eba.get_trade_partners(ba)]].sum(axis=1)
-
-    # Create EBA object for CO2
-    poll_data = BA_DATA(df=df_j.loc[:, [col for col in df_j.columns if "%s_" % poll in col]],
-              variable=poll)
     # Create EBA object for ELEC
     elec = BA_DATA(df=df_j.loc[:, [col for col in df_j.columns if "EBA." in col]],
               variable="E")
+    fileNm = data_file("SEED_E_%s" % time_lev)
+    save_SEED(elec.df, fileNm, time_lev, update_from, append, commit)
 
-    # Save results
-    fileNm = os.path.join(DATA_PATH, "analysis/SEED_%s_%s.csv" % (poll, time_lev))
-    poll_data.df.to_csv(fileNm)
-    
-    fileNm = os.path.join(DATA_PATH, "analysis/SEED_E_%s.csv" % time_lev)
-    elec.df.to_csv(fileNm)
-    
-    # Also save emissions factors
-    # Add columns for production-based EFs
-    for ba in eba.regions:
-        df_j.loc[:, "%si_%s_NG" % (poll, ba)] = (
-            poll_data.df.loc[:, poll_data.get_cols(r=ba, field="NG")].values.flatten()
-            / elec.df.loc[:, elec.get_cols(r=ba, field="NG")].values.flatten())
+    for k, poll in enumerate(polls):
+        poll_data, efs = SEED_frames(df_j, eba, poll, X[:, :, k], ID,
+                                     pattern, hours=hours)
+
+        # Save results
+        fileNm = data_file("SEED_%s_%s" % (poll, time_lev))
+        save_SEED(poll_data.df, fileNm, time_lev, update_from, append, commit)
+        fileNm = data_file("SEED_EFs_%s_%s" % (poll, time_lev))
+        save_SEED(efs, fileNm, time_lev, update_from, append, commit)
+
+
+def makeSEED(poll="CO2", time_lev="H", df_j=None, eba=None,
+             attribution=False, update_from=None, rule=None, chunk_size=None,
+             cube=False, **kwargs):
+    '''
+    Combine AMPD and EBA data to create the SEED data set.
+    Calculates consumption-based emissions.
+    poll can be a single pollutant or a list of pollutants: in the latter case
+    each linear system is factorized once and solved for all pollutants. The
+    merged inputs can be passed in as df_j and eba (see load_SEED_data) to
+    avoid re-loading them. Other keyword arguments (e.g. backend, blocks,
+    n_jobs, reduce) are passed on to consumption_emissions_batch.
+    Solver diagnostics, with one row per time step, are saved in
+    SEED_diag_<time_lev>.csv. If attribution is True, the source attribution
+    of consumption emissions is also computed and saved for each pollutant
+    (see attribution.makeAttribution). If cube is True, the outputs for
+    time_lev are also saved in a chunked array store (see cube.makeCube).
+    If update_from is a timestamp, only the time steps from update_from
+    onward (for hourly data) or the periods that contain them are computed,
+    and the existing outputs are updated (see save_SEED).
+    time_lev is used in the names of the output files. The aggregation rule
+    is rule if it is given, and time_lev otherwise (see aggregate_time); "H"
+    keeps the time step of the data (see load.TIME_STEP). If chunk_size is
+    given, data at that time step is solved and saved in chunks of
+    chunk_size time steps.
+    Several levels can be computed in one call, with the inputs loaded once,
+    by passing a list of levels, or a dict mapping levels to rules, as
+    time_lev.
+    '''
+    logger = logging.getLogger('clean')
+    polls = [poll] if isinstance(poll, str) else list(poll)
+
+    if not isinstance(time_lev, str):
+        if df_j is None:
+            df_j, eba = load_SEED_data(polls)
+        if not isinstance(time_lev, dict):
+            time_lev = {lev: lev for lev in time_lev}
+        for lev, rule in time_lev.items():
+            makeSEED(poll, lev, df_j=df_j, eba=eba, attribution=attribution,
+                     update_from=update_from, rule=rule, chunk_size=chunk_size,
+                     cube=cube, **kwargs)
+        return
+
+    if rule is None:
+        rule = time_lev
+    logger.info("Starting SEED - %s - %s" % (", ".join(polls), time_lev))
+    if attribution and (update_from is not None):
+        raise ValueError("The source attribution cannot be updated"
+                         " incrementally")
+
+    if df_j is None:
+        df_j, eba = load_SEED_data(polls)
+
+    if update_from is not None:
+        new = df_j.index >= pd.Timestamp(update_from)
+        if not (isinstance(rule, str) and (rule == "H")):
+            groups = df_j.groupby(time_groups(df_j.index, rule)).ngroup()
+            new = np.isin(groups.values, groups.values[new])
+        df_j = df_j[new]
+        logger.debug("Updating %d time steps" % len(df_j))
+    df_j = aggregate_time(df_j, rule)
+
+    # Hourly data is solved and saved in chunks of chunk_size time steps, so
+    # that memory use does not depend on the length of the series
+    if (chunk_size is None) or not (isinstance(rule, str) and (rule == "H")):
+        chunk_size = max(len(df_j), 1)
+    # The outputs are only moved in place with the last chunk
+    for k, start in enumerate(range(0, len(df_j), chunk_size)):
+        _SEED_chunk(df_j.iloc[start:start + chunk_size], eba, polls, time_lev,
+                    update_from=update_from, append=(k > 0),
+                    commit=(start + chunk_size >= len(df_j)),
+                    hours=row_hours(rule), **kwargs)
+
+    if attribution:
+        from attribution import makeAttribution
+        for poll in polls:
+            makeAttribution(df_j, eba, poll, time_lev,
+                            pattern=trade_pattern(eba), **kwargs)
+
+    if cube:
+        from cube import makeCube
+        makeCube(time_lev, update_from=update_from)
+
+
+def SEED_frames(df_j, eba, poll, X, ID, pattern, hours=None):
+    '''
+    Create the consumption, trade and emissions factor columns for poll from
+    the (T, n) array of consumption emissions intensities X, the (T, n, n)
+    interchange array ID and the trade pattern (see trade_arrays and
+    trade_pattern). All columns are computed as array operations and each
+    output frame is allocated once.
+    Returns a BA_DATA object with the production, consumption and trade
+    emissions for poll, and a data frame with the production- and
+    consumption-based emissions factors, in kg/MWh for rows of hours hours
+    (by default, the time step of the data - see row_hours).
+    '''
+    if hours is None:
+        hours = step_hours()
+    D = df_j.loc[:, eba.get_cols(field="D")].values
+    NG = df_j.loc[:, eba.get_cols(field="NG")].values
+    F = df_j.loc[:, ["%s_%s_NG" % (poll, ba) for ba in eba.regions]].values
+    ii, jj = np.nonzero(pattern)  # partners, in the order of eba.regions
+
+    # Consumption
+    cons = X * D
+
+    # Pairwise trade: imports are valued at the partner's intensity, and
+    # exports at the local intensity
+    pair = ID[:, ii, jj]
+    trade = pair.clip(max=0) * X[:, jj] + pair.clip(min=0) * X[:, ii]
+
+    # Total trade - missing values are skipped, as in DataFrame.sum
+    TI = np.zeros(X.shape)
+    np.add.at(TI.T, ii, np.nan_to_num(trade).T)
+
+    # Production, consumption, trade and total trade, in that order
+    ng_cols = [col for col in df_j.columns if "%s_" % poll in col]
+    cols = (ng_cols + ["%s_%s_D" % (poll, ba) for ba in eba.regions]
+            + ["%s_%s-%s_ID" % (poll, eba.regions[i], eba.regions[j])
+               for i, j in zip(ii, jj)]
+            + ["%s_%s_TI" % (poll, ba) for ba in eba.regions])
+    poll_data = BA_DATA(df=pd.DataFrame(
+        np.hstack([df_j.loc[:, ng_cols].values, cons, trade, TI]),
+        index=df_j.index, columns=cols), variable=poll)
 
     # Extract production- and consumption-based EFs
-    efs = 1000 * df_j.loc[:, [col for col in df_j.columns if "%si_" % poll in col]]
-    fileNm = os.path.join(DATA_PATH, "analysis/SEED_EFs_%s_%s.csv" % (poll, time_lev))
-    efs.to_csv(fileNm)
-    
-def SEED():
-    for poll in ["CO2", "SO2", "NOX"]:
-        makeSEED(poll, time_lev="Y")
-    for time_lev in ["M", "H"]:
-        makeSEED("CO2", time_lev)
+    efs = pd.DataFrame(
+        1000 / hours * np.hstack([X, F / NG]), index=df_j.index,
+        columns=(["%si_%s_D" % (poll, ba) for ba in eba.regions]
+                 + ["%si_%s_NG" % (poll, ba) for ba in eba.regions]))
+    return poll_data, efs
+
+
+def SEED(cube=True, **kwargs):
+    '''
+    Create the SEED data set, and the chunked array stores of the outputs if
+    cube is True. Keyword arguments are passed on to makeSEED.
+    '''
+    # Load the inputs once, and solve for all pollutants at the same time
+    df_j, eba = load_SEED_data()
+    makeSEED(POLLS, time_lev="Y", df_j=df_j, eba=eba, cube=cube, **kwargs)
+    makeSEED("CO2", ["M", "H"], df_j=df_j, eba=eba, cube=cube, **kwargs)
+
+
+def updateSEED(overlap=24, df_j=None, eba=None, cube=True, **kwargs):
+    '''
+    Incrementally update the SEED data set after new data has been added.
+    The last time step already computed is read from SEED_CO2_H.csv, and
+    only the time steps after it are computed, as well as the overlap
+    previous hours, to take into account revisions to the data. Hourly
+    outputs are updated by appending these time steps, and the monthly and
+    yearly outputs are updated for the months and years that contain them.
+    The chunked array stores are updated if cube is True. Keyword arguments
+    are passed on to makeSEED.
+    '''
+    logger = logging.getLogger('clean')
+    fileNm = data_file("SEED_CO2_H", read=True)
+    if not os.path.exists(fileNm):
+        logger.info("No existing SEED data set - creating it")
+        SEED(cube=cube, **kwargs)
+        return
+    last = _last_index(fileNm)
+    update_from = last - pd.Timedelta(hours=overlap)
+    if df_j is None:
+        df_j, eba = load_SEED_data()
+    logger.info("Updating SEED from %s (last time step was %s)" % (
+        update_from, last))
+    if (df_j.index > last).sum() == 0:
+        logger.info("No new data")
+        return
+    makeSEED(POLLS, time_lev="Y", df_j=df_j, eba=eba,
+             update_from=update_from, cube=cube, **kwargs)
+    makeSEED("CO2", ["M", "H"], df_j=df_j, eba=eba, update_from=update_from,
+             cube=cube, **kwargs)
@@ -0,0 +1,233 @@
+'''
+Aggregation of BA-level SEED results to larger regions.
+
+A mapping from BAs to regions is represented as a sparse (m, n) weight matrix
+W: W[r, i] is the share of BA i in region r (1 for EIA regions and
+interconnections, the share of the BA's generation in each state for
+states). For a BA_DATA object, the weights are expanded to a sparse matrix
+that maps all of its columns to the columns of the aggregated data set,
+following the naming conventions in BA_DATA.KEYS, so that aggregation is
+one matrix product:
+    NG, D and TI columns are aggregated with W
+    ID columns are aggregated with W ID W^T - trade within a region cancels
+Intensities are demand (or generation) weighted: they are calculated from
+the aggregated emissions and electricity.
+'''
+import os
+import logging
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from load import BA_DATA, EGRID, data_file, write_data
+from SEED import row_hours
+
+DATA_PATH = os.getenv('DATA_PATH')
+if DATA_PATH is None:
+    raise ValueError("DATA_PATH needs to be set")
+
+# EIA-930 regions
+EIA_REGIONS = {
+    "CAL": ["BANC", "CISO", "IID", "LDWP", "TIDC"],
+    "CAR": ["CPLE", "CPLW", "DUK", "SC", "SCEG", "YAD"],
+    "CENT": ["SPA", "SWPP"],
+    "FLA": ["FMPP", "FPC", "FPL", "GVL", "HST", "JEA", "NSB", "SEC", "TAL",
+            "TEC"],
+    "MIDA": ["OVEC", "PJM"],
+    "MIDW": ["AECI", "EEI", "LGEE", "MISO"],
+    "NE": ["ISNE"],
+    "NY": ["NYIS"],
+    "NW": ["AVA", "BPAT", "CHPD", "DOPD", "GCPD", "GWA", "IPCO", "NEVP",
+           "NWMT", "PACE", "PACW", "PGE", "PSCO", "PSEI", "SCL", "TPWR",
+           "WACM", "WAUW", "WWA"],
+    "SE": ["AEC", "SEPA", "SOCO"],
+    "SW": ["AZPS", "DEAA", "EPE", "GRIF", "GRMA", "HGMA", "PNM", "SRP",
+           "TEPC", "WALC"],
+    "TEN": ["TVA"],
+    "TEX": ["ERCO"],
+    "CAN": ["NBSO"]}
+
+# Interconnections - all BAs that are not listed are in the Eastern
+# Interconnection
+INTERCONNECTIONS = {
+    "WECC": ["AVA", "AZPS", "BANC", "BPAT", "CHPD", "CISO", "DEAA", "DOPD",
+             "EPE", "GCPD", "GRIF", "GRMA", "GWA", "HGMA", "IID", "IPCO",
+             "LDWP", "NEVP", "NWMT", "PACE", "PACW", "PGE", "PNM", "PSCO",
+             "PSEI", "SCL", "SRP", "TEPC", "TIDC", "TPWR", "WACM", "WALC",
+             "WAUW", "WWA"],
+    "ERCOT": ["ERCO"],
+    "EI": None}
+
+# Cache for the aggregation matrices, keyed by the mapping and the columns
+_AGGREGATIONS = {}
+
+
+def state_mapping():
+    '''
+    Return the mapping from BAs to states, with weights equal to the share of
+    the annual generation of each BA in each state (from eGRID plant data).
+    '''
+    egrid_plnt = EGRID(sheet_name='PLNT16')
+    df = egrid_plnt.df.loc[:, ["BACODE", "PSTATABB", "PLNGENAN"]].dropna()
+    df = df[df.PLNGENAN > 0]
+    df.loc[df.BACODE == 'CSTO', 'BACODE'] = 'BPAT'
+    gen = df.groupby(["PSTATABB", "BACODE"]).PLNGENAN.sum()
+    share = gen / gen.groupby(level="BACODE").transform("sum")
+    mapping = {}
+    for (state, ba), w in share.items():
+        mapping.setdefault(state, {})[ba] = w
+    return mapping
+
+
+def get_mapping(mapping):
+    '''
+    Return the mapping called mapping ("regions", "interconnections" or
+    "states"), or mapping itself if it is a dict.
+    '''
+    if isinstance(mapping, dict):
+        return mapping
+    if mapping == "regions":
+        return EIA_REGIONS
+    elif mapping == "interconnections":
+        return INTERCONNECTIONS
+    elif mapping == "states":
+        return state_mapping()
+    raise ValueError("Unknown mapping %s" % mapping)
+
+
+def weight_matrix(mapping, bas):
+    '''
+    Return the sparse (m, n) weight matrix for mapping, a dict from region
+    names to lists of BAs, or to dicts of weights by BA, and the list of the
+    m regions. A region mapped to None gets all the BAs in bas that are not
+    in another region. BAs that are not in bas are ignored.
+    '''
+    regions = sorted(mapping.keys())
+    ind = {ba: i for i, ba in enumerate(bas)}
+    listed = set([ba for r in regions if mapping[r] is not None
+                  for ba in mapping[r]])
+    rows, cols, vals = [], [], []
+    for k, r in enumerate(regions):
+        weights = mapping[r]
+        if weights is None:
+            weights = [ba for ba in bas if ba not in listed]
+        if not isinstance(weights, dict):
+            weights = {ba: 1. for ba in weights}
+        for ba, w in weights.items():
+            if ba in ind:
+                rows.append(k)
+                cols.append(ind[ba])
+                vals.append(w)
+    return sparse.csr_matrix((vals, (rows, cols)),
+                             shape=(len(regions), len(bas))), regions
+
+
+def aggregation_matrix(data, W, regions):
+    '''
+    Return the sparse matrix that maps the columns of BA_DATA object data to
+    the columns of the aggregated data set, and the list of these columns.
+    '''
+    W = W.tocsc()
+    col_ind = {col: k for k, col in enumerate(data.df.columns)}
+    rows, cols, vals = [], [], []
+    out_cols = []
+
+    def add(col_in, col_out, w):
+        if col_out not in out_ind:
+            out_ind[col_out] = len(out_cols)
+            out_cols.append(col_out)
+        rows.append(col_ind[col_in])
+        cols.append(out_ind[col_out])
+        vals.append(w)
+
+    out_ind = {}
+    for field in ["NG", "D", "TI"]:
+        if field not in data.KEY:
+            continue
+        for i, ba in enumerate(data.regions):
+            col = data.KEY[field] % ba
+            if col not in col_ind:
+                continue
+            for k in range(W.indptr[i], W.indptr[i + 1]):
+                add(col, data.KEY[field] % regions[W.indices[k]], W.data[k])
+    if "ID" in data.KEY:
+        for i, ba in enumerate(data.regions):
+            for j, ba2 in enumerate(data.regions):
+                col = data.KEY["ID"] % (ba, ba2)
+                if col not in col_ind:
+                    continue
+                for k in range(W.indptr[i], W.indptr[i + 1]):
+                    for k2 in range(W.indptr[j], W.indptr[j + 1]):
+                        if W.indices[k] != W.indices[k2]:
+                            add(col, data.KEY["ID"] % (
+                                regions[W.indices[k]],
+                                regions[W.indices[k2]]),
+                                W.data[k] * W.data[k2])
+    return sparse.csr_matrix((vals, (rows, cols)), shape=(
+        len(data.df.columns), len(out_cols))), out_cols
+
+
+def aggregate(data, mapping="regions"):
+    '''
+    Aggregate BA_DATA object data (electricity or emissions, not
+    intensities) with mapping (see get_mapping and weight_matrix). Returns a
+    BA_DATA object with the same variable. The aggregation matrices are
+    cached for each mapping and set of columns.
+    '''
+    key = (mapping if isinstance(mapping, str) else repr(sorted(
+        mapping.items())), data.variable, tuple(data.df.columns))
+    if key not in _AGGREGATIONS:
+        W, regions = weight_matrix(get_mapping(mapping), data.regions)
+        _AGGREGATIONS[key] = aggregation_matrix(data, W, regions)
+    M, out_cols = _AGGREGATIONS[key]
+    values = M.T.dot(data.df.values.T).T
+    return BA_DATA(df=pd.DataFrame(values, index=data.df.index,
+                                   columns=out_cols), variable=data.variable)
+
+
+def intensities(poll_data, elec, time_lev="H"):
+    '''
+    Return the BA_DATA object of consumption and production intensities (in
+    kg/MWh, as in SEED_EFs) from the emissions poll_data and electricity elec
+    (e.g. aggregated with the same mapping) for time level time_lev (see
+    SEED.row_hours).
+    '''
+    poll = poll_data.variable
+    df = pd.DataFrame(index=poll_data.df.index)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for field in ["D", "NG"]:
+            values = 1000 / row_hours(time_lev) * (
+                poll_data.df.loc[:, poll_data.get_cols(field=field)].values
+                / elec.df.loc[:, elec.get_cols(
+                    poll_data.regions, field=field)].values)
+            for k, r in enumerate(poll_data.regions):
+                df[BA_DATA.KEYS[poll + "i"][field] % r] = values[:, k]
+    return BA_DATA(df=df, variable=poll + "i")
+
+
+def makeAggregates(poll="CO2", time_lev="H", mapping="regions",
+                   name=None):
+    '''
+    Aggregate the SEED results for pollutant poll and time level time_lev
+    with mapping, and save them as SEED_<name>_E_<time_lev>.csv,
+    SEED_<name>_<poll>_<time_lev>.csv and
+    SEED_<name>_EFs_<poll>_<time_lev>.csv, that can be loaded with
+    BA_DATA(fileNm=..., variable=...). name defaults to mapping.
+    Returns the three BA_DATA objects.
+    '''
+    logger = logging.getLogger('clean')
+    if name is None:
+        name = mapping
+    logger.info("Aggregating SEED - %s - %s - %s" % (poll, time_lev, name))
+    elec = BA_DATA(fileNm=data_file("SEED_E_%s" % time_lev, read=True),
+                   variable="E")
+    poll_data = BA_DATA(fileNm=data_file("SEED_%s_%s" % (poll, time_lev),
+                                         read=True), variable=poll)
+    elec = aggregate(elec, mapping)
+    poll_data = aggregate(poll_data, mapping)
+    efs = intensities(poll_data, elec, time_lev)
+    for data, fileNm in [
+            (elec, "SEED_%s_E_%s" % (name, time_lev)),
+            (poll_data, "SEED_%s_%s_%s" % (name, poll, time_lev)),
+            (efs, "SEED_%s_EFs_%s_%s" % (name, poll, time_lev))]:
+        write_data(data.df, data_file(fileNm))
+    return elec, poll_data, efs
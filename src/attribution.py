@@ -0,0 +1,314 @@
+'''
+Source attribution of consumption emissions.
+
+The consumption emissions intensities X solve A X = F, so they are linear in
+the emissions produced F. Solving with diag(F) as right-hand side instead of
+F gives, for each time step, the n x n matrix of the contributions of each
+producing BA to the intensity at each consuming BA. Multiplying by demand
+gives the emissions consumed in BA i that were produced in BA j. These are
+further split between plants using the AMPD plant-level data.
+'''
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from load import AMPD, EGRID, to_time_step
+from SEED import consumption_emissions_batch, trade_arrays
+
+DATA_PATH = os.getenv('DATA_PATH')
+if DATA_PATH is None:
+    raise ValueError("DATA_PATH needs to be set")
+
+
+def source_attribution(F, P, ID, D, out=None, chunk_size=1000, **kwargs):
+    '''
+    Compute the source attribution of consumption emissions for all time
+    steps:
+        S[t, i, j] = emissions consumed in BA i that were produced in BA j
+        F: (T, n) array of emissions produced
+        P: (T, n) array of generation
+        ID: (T, n, n) array of interchange
+        D: (T, n) array of demand
+    The linear systems are solved in chunks of chunk_size time steps, with
+    the n unit sources as a multi-column right-hand side (so each system is
+    factorized once). Results are written in out if it is given (e.g. a
+    memory-mapped array), otherwise in a new (T, n, n) float32 array. Other
+    keyword arguments are passed on to consumption_emissions_batch.
+    Summing S over producers gives consumption emissions.
+    '''
+    T, n = P.shape
+    if out is None:
+        out = np.empty((T, n, n), dtype=np.float32)
+    idx = np.arange(n)
+    for start in range(0, T, chunk_size):
+        sl = slice(start, min(start + chunk_size, T))
+        b = np.zeros((sl.stop - sl.start, n, n))
+        b[:, idx, idx] = F[sl]
+        X, _ = consumption_emissions_batch(b, P[sl], ID[sl], **kwargs)
+        out[sl] = X * D[sl, :, np.newaxis]
+    return out
+
+
+class ATTRIBUTION(object):
+    '''
+    Class to handle source attribution data: a (T, n, n) float32 array of
+    emissions consumed in BA i (second axis) that were produced in BA j
+    (third axis), with the time index and the list of regions.
+
+    On disk, the array is stored as a .npy file, next to a small .json file
+    with the regions and time index. Files are memory-mapped when loaded, so
+    that slicing only reads the data that is needed.
+
+    Methods
+    -------
+    get(self, consumer, producer, start, end) : slice the array.
+    get_frame(self, consumer, producer, start, end) : data frame for one
+        consuming BA.
+    save(self, fileNm) : save to disk.
+    '''
+
+    def __init__(self, fileNm=None, poll="CO2", time_lev="H", data=None,
+                 regions=None, index=None):
+        self.logger = logging.getLogger('load')
+
+        if data is not None:
+            self.data = data
+            self.regions = list(regions)
+            self.index = pd.Index(index)
+        else:
+            if fileNm is None:
+                fileNm = os.path.join(DATA_PATH, "analysis",
+                                      "SEED_attribution_%s_%s.npy" % (
+                                          poll, time_lev))
+            self.logger.info('Loading attribution from %s' % fileNm)
+            self.data = np.load(fileNm, mmap_mode='r')
+            with open(fileNm.replace(".npy", ".json"), "r") as fr:
+                meta = json.load(fr)
+            self.regions = meta["regions"]
+            if meta["time"]:
+                self.index = pd.to_datetime(meta["index"])
+            else:
+                self.index = pd.Index(meta["index"])
+        self.fileNm = fileNm
+
+    def _region_ind(self, r):
+        if r is None:
+            return slice(None)
+        if isinstance(r, str):
+            return self.regions.index(r)
+        return [self.regions.index(ir) for ir in r]
+
+    def get(self, consumer=None, producer=None, start=None, end=None):
+        '''
+        Return a slice of the attribution array, for the consuming and
+        producing BAs (a BA, a list of BAs or None for all of them) and the
+        time range from start to end (inclusive).
+        '''
+        tsl = self.index.slice_indexer(start, end)
+        data = self.data[tsl]
+        data = data[:, self._region_ind(consumer)]
+        if isinstance(consumer, str):
+            return data[:, self._region_ind(producer)]
+        return data[:, :, self._region_ind(producer)]
+
+    def get_frame(self, consumer, producer=None, start=None, end=None):
+        '''
+        Return a data frame with the emissions consumed in BA consumer, by
+        producing BA, for the time range from start to end.
+        '''
+        if producer is None:
+            producer = self.regions
+        if isinstance(producer, str):
+            producer = [producer]
+        tsl = self.index.slice_indexer(start, end)
+        return pd.DataFrame(
+            self.get(consumer, producer, start, end), index=self.index[tsl],
+            columns=producer)
+
+    def save(self, fileNm=None):
+        if fileNm is None:
+            fileNm = self.fileNm
+        self.logger.info('Saving attribution to %s' % fileNm)
+        np.save(fileNm, np.asarray(self.data, dtype=np.float32))
+        self._save_meta(fileNm)
+
+    def _save_meta(self, fileNm):
+        time = isinstance(self.index, pd.DatetimeIndex)
+        with open(fileNm.replace(".npy", ".json"), "w") as fw:
+            json.dump({"regions": self.regions, "time": time,
+                       "index": [str(i) if time else int(i)
+                                 for i in self.index]}, fw)
+        self.fileNm = fileNm
+
+
+def makeAttribution(df_j, eba, poll, time_lev, chunk_size=1000, **kwargs):
+    '''
+    Compute the source attribution for pollutant poll from the merged SEED
+    data frame (see SEED.load_SEED_data) and save it as
+    SEED_attribution_<poll>_<time_lev>.npy. The array is written directly to
+    a memory-mapped file, chunk by chunk.
+    '''
+    logger = logging.getLogger('clean')
+    logger.info("Starting attribution - %s - %s" % (poll, time_lev))
+    P, ID = trade_arrays(df_j, eba)
+    F = df_j.loc[:, ["%s_%s_NG" % (poll, ba) for ba in eba.regions]].values
+    D = df_j.loc[:, eba.get_cols(field="D")].values
+
+    fileNm = os.path.join(DATA_PATH, "analysis",
+                          "SEED_attribution_%s_%s.npy" % (poll, time_lev))
+    out = np.lib.format.open_memmap(
+        fileNm, mode="w+", dtype=np.float32, shape=ID.shape)
+    source_attribution(F, P, ID, D, out=out, chunk_size=chunk_size,
+                       **kwargs)
+    out.flush()
+    attr = ATTRIBUTION(data=out, regions=eba.regions, index=df_j.index)
+    attr._save_meta(fileNm)
+    return attr
+
+
+def load_plant_data(poll, regions, index):
+    '''
+    Load hourly plant-level emissions of pollutant poll from AMPD_1, with
+    plants mapped to BAs using the eGRID BACODE field and timestamps changed
+    to UTC as in AMPD_2, and split over the time steps of index (see
+    plant_time_steps). Only plants in regions are kept.
+    Returns a (T, p) data frame indexed like index with one column per
+    ORISPL code, and the list of BACODEs of the plants.
+    '''
+    from AMPD_2 import getTimezoneInfo
+    ampd = AMPD(step=1)
+    egrid_plnt = EGRID(sheet_name='PLNT16')
+    bacodes = dict(zip(egrid_plnt.df.ORISPL.values,
+                       egrid_plnt.df.BACODE.values))
+    df = ampd.df.loc[:, ["ORISPL_CODE", "OP_DATE_TIME", poll]]
+    df.loc[:, "BACODE"] = df.ORISPL_CODE.map(bacodes)
+
+    # Absorb CSTO (1 plant) in BPAT
+    df.loc[df.BACODE == 'CSTO', 'BACODE'] = 'BPAT'
+    df = df[df.BACODE.isin(regions)]
+
+    # Change timestamps to UTC
+    BA_to_tz = getTimezoneInfo()
+    df.loc[:, "DATE_TIME_UTC"] = df.OP_DATE_TIME - pd.to_timedelta(
+        df.BACODE.map(BA_to_tz), unit="h")
+    E = df.pivot_table(index="DATE_TIME_UTC", columns="ORISPL_CODE",
+                       values=poll, aggfunc="sum")
+    E = plant_time_steps(E, index)
+    plant_ba = df.groupby("ORISPL_CODE").BACODE.first()
+    return E, list(plant_ba.loc[E.columns].values)
+
+
+def plant_time_steps(E, index):
+    '''
+    Return the hourly plant emissions E on time index index: hourly values
+    are split evenly over the time steps, as in AMPD_2 (see
+    load.to_time_step), and time steps without data are zero.
+    '''
+    hours = pd.date_range(index[0].floor("H"), index[-1].floor("H"), freq="H")
+    return to_time_step(E.reindex(hours).fillna(0.)).reindex(index).fillna(0.)
+
+
+def plant_incidence(plant_ba, regions):
+    '''
+    Return the sparse (n, p) plant to BA incidence matrix: M[j, k] is 1 if
+    plant k is in BA j.
+    '''
+    rows = [regions.index(ba) for ba in plant_ba]
+    return sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, np.arange(len(rows)))),
+        shape=(len(regions), len(rows)))
+
+
+class PLANT_ATTRIBUTION(object):
+    '''
+    Class to attribute consumption emissions to individual plants.
+
+    The emissions consumed in BA i that were produced in BA j (see
+    ATTRIBUTION) are split between the plants in BA j in proportion to their
+    emissions:
+        C[t, i, k] = S[t, i, j] * E[t, k] / sum_{k' in j} E[t, k']
+    where the plant totals by BA are obtained with the sparse plant to BA
+    incidence matrix M. Results are computed in chunks of time steps and only
+    for the requested consuming BAs, so that the full plant x BA x time cube
+    is never held in memory. Emissions produced in BAs with no plant data at
+    a time step are not attributed to plants.
+
+    Methods
+    -------
+    get(self, consumer, start, end) : (T, p) or (T, len(consumer), p) array.
+    get_frame(self, consumer, start, end) : data frame for one consuming BA.
+    total(self, consumer, start, end) : data frame of emissions consumed in
+        each consuming BA by plant, summed over the time range.
+    '''
+
+    def __init__(self, attr, E, plant_ba, chunk_size=100):
+        '''
+        attr: ATTRIBUTION object
+        E: (T, p) data frame of plant emissions, indexed like attr, or
+            hourly (see plant_time_steps)
+        plant_ba: list of the BAs of the plants
+        '''
+        self.attr = attr
+        if not E.index.equals(attr.index):
+            E = plant_time_steps(E, attr.index)
+        self.E = E.values
+        self.plants = list(E.columns)
+        self.M = plant_incidence(plant_ba, attr.regions)
+        self.chunk_size = chunk_size
+
+    def _chunks(self, consumer, start, end):
+        steps = range(len(self.attr.index))[
+            self.attr.index.slice_indexer(start, end)]
+        ind = self.attr._region_ind(consumer)
+        if isinstance(consumer, str):
+            ind = [ind]
+        for c0 in range(0, len(steps), self.chunk_size):
+            sl = slice(steps[c0], steps[min(c0 + self.chunk_size,
+                                             len(steps)) - 1] + 1)
+            E = self.E[sl]
+            tot = self.M.dot(E.T).T
+            S = np.asarray(self.attr.data[sl][:, ind], dtype=float)
+            S = np.divide(S, tot[:, np.newaxis, :], out=np.zeros_like(S),
+                          where=tot[:, np.newaxis, :] > 0)
+            # (chunk, m, n) x (n, p) sparse product, scaled by plant emissions
+            C = self.M.T.dot(S.reshape(-1, S.shape[-1]).T).T
+            C = C.reshape(S.shape[0], S.shape[1], -1) * E[:, np.newaxis, :]
+            yield sl, C
+
+    def get(self, consumer, start=None, end=None):
+        '''
+        Return the emissions consumed in BA consumer (a BA or a list of BAs)
+        by plant, for the time range from start to end (inclusive).
+        '''
+        C = np.concatenate([C for _, C in self._chunks(consumer, start, end)])
+        if isinstance(consumer, str):
+            return C[:, 0]
+        return C
+
+    def get_frame(self, consumer, start=None, end=None):
+        tsl = self.attr.index.slice_indexer(start, end)
+        return pd.DataFrame(self.get(consumer, start, end),
+                            index=self.attr.index[tsl], columns=self.plants)
+
+    def total(self, consumer=None, start=None, end=None):
+        if consumer is None:
+            consumer = self.attr.regions
+        if isinstance(consumer, str):
+            consumer = [consumer]
+        tot = np.zeros((len(consumer), len(self.plants)))
+        for _, C in self._chunks(consumer, start, end):
+            tot += C.sum(axis=0)
+        return pd.DataFrame(tot, index=consumer, columns=self.plants)
+
+
+def load_plant_attribution(poll="CO2", chunk_size=100):
+    '''
+    Load the hourly source attribution for pollutant poll (see
+    makeAttribution) and the plant-level emissions, and return the
+    corresponding PLANT_ATTRIBUTION object.
+    '''
+    attr = ATTRIBUTION(poll=poll, time_lev="H")
+    E, plant_ba = load_plant_data(poll, attr.regions, attr.index)
+    return PLANT_ATTRIBUTION(attr, E, plant_ba, chunk_size=chunk_size)
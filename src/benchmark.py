@@ -0,0 +1,139 @@
+'''
+Benchmark of the consumption emissions solver at different time resolutions.
+
+Synthetic data is generated for a trade network of the size of the EBA data
+set, and solved in chunks of time steps with consumption_emissions_batch, as
+in makeSEED. Throughput is reported in time steps per second, with the peak
+memory allocated during the run: with chunks, memory use depends on the chunk
+size and not on the length of the series.
+
+The reduction of the trade network (see trade_reduction) is measured on the
+same data: the number of nodes eliminated, the size of the core system, and
+the throughput with and without reduce. With "eba", the trade network of the
+EBA data set is used instead of a synthetic one.
+
+Usage: python benchmark.py [days] [eba]
+'''
+import sys
+import time
+import logging
+import tracemalloc
+import numpy as np
+from load import BA_DATA, step_hours
+from SEED import consumption_emissions_batch, trade_pattern, trade_reduction
+
+
+def synthetic_pattern(n=66, degree=3, seed=0):
+    '''
+    Return a random connected (n, n) boolean adjacency matrix with about
+    degree trade partners per BA.
+    '''
+    rng = np.random.RandomState(seed)
+    pattern = np.zeros((n, n), dtype=bool)
+    for i in range(1, n):
+        pattern[i, rng.randint(i)] = True
+    for _ in range(n * (degree - 2) // 2):
+        i, j = rng.randint(n, size=2)
+        pattern[i, j] = i != j
+    return pattern | pattern.T
+
+
+def synthetic_data(T, pattern, rng):
+    '''
+    Return synthetic emissions F, generation P and interchange ID for T time
+    steps on the trade network pattern.
+    '''
+    n = len(pattern)
+    P = rng.uniform(100., 1000., size=(T, n))
+    F = P * rng.uniform(0., 1., size=(T, n))
+    ID = np.triu(rng.normal(0., 100., size=(T, n, n)) * pattern, 1)
+    ID -= ID.transpose((0, 2, 1))
+    return F, P, ID
+
+
+def benchmark(freqs=("H", "5min"), days=7, n=66, chunk_size=2016,
+              **kwargs):
+    '''
+    Solve days of synthetic data at each time resolution in freqs, in chunks
+    of chunk_size time steps. Other keyword arguments are passed on to
+    consumption_emissions_batch. Returns a list of dicts with the time
+    resolution, number of time steps, throughput (time steps per second) and
+    peak memory (MB).
+    '''
+    logger = logging.getLogger('clean')
+    pattern = synthetic_pattern(n)
+    results = []
+    for freq in freqs:
+        T = int(round(days * 24 / step_hours(freq)))
+        elapsed, peak = _run(pattern, T, chunk_size, **kwargs)
+        results.append({"freq": freq, "steps": T, "steps_per_s": T / elapsed,
+                        "peak_MB": peak / 1e6})
+        logger.info("%s: %d time steps, %.0f steps/s, peak memory %.0f MB" % (
+            freq, T, T / elapsed, peak / 1e6))
+    return results
+
+
+def _run(pattern, T, chunk_size, **kwargs):
+    '''
+    Solve T time steps of synthetic data on the trade network pattern, in
+    chunks of chunk_size time steps. Returns the time spent solving (s) and
+    the peak memory allocated (bytes).
+    '''
+    rng = np.random.RandomState(0)
+    elapsed = 0.
+    tracemalloc.start()
+    for start in range(0, T, chunk_size):
+        F, P, ID = synthetic_data(min(chunk_size, T - start), pattern, rng)
+        start_time = time.time()
+        consumption_emissions_batch(F, P, ID, pattern=pattern, **kwargs)
+        elapsed += time.time() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def benchmark_reduction(pattern=None, freq="H", days=7, chunk_size=2016,
+                        **kwargs):
+    '''
+    Measure how much trade_reduction shrinks the trade network pattern (by
+    default the synthetic one), and solve days of synthetic data at time
+    resolution freq with and without reduce. Other keyword arguments are
+    passed on to consumption_emissions_batch. Returns a dict with the number
+    of nodes, of eliminated nodes and of nodes in the core system, and the
+    throughput (time steps per second) without and with reduce.
+    '''
+    logger = logging.getLogger('clean')
+    if pattern is None:
+        pattern = synthetic_pattern()
+    order, _, core = trade_reduction(pattern)
+    T = int(round(days * 24 / step_hours(freq)))
+    result = {"n": len(pattern), "eliminated": len(order),
+              "core": len(core)}
+    for reduce in [False, True]:
+        elapsed, _ = _run(pattern, T, chunk_size, reduce=reduce, **kwargs)
+        result["steps_per_s_reduce" if reduce else "steps_per_s"] = (
+            T / elapsed)
+    logger.info("Reduction: %d of %d nodes eliminated, core of %d nodes, "
+                "%.0f steps/s (%.0f without reduce)" % (
+                    result["eliminated"], result["n"], result["core"],
+                    result["steps_per_s_reduce"], result["steps_per_s"]))
+    return result
+
+
+if __name__ == '__main__':
+    days = float(sys.argv[1]) if len(sys.argv) > 1 else 7
+    print("%8s %10s %12s %10s" % ("freq", "steps", "steps/s", "peak MB"))
+    for res in benchmark(days=days):
+        print("%8s %10d %12.0f %10.0f" % (
+            res["freq"], res["steps"], res["steps_per_s"], res["peak_MB"]))
+
+    pattern = None
+    if "eba" in sys.argv[2:]:
+        pattern = trade_pattern(BA_DATA(step=3, edges=True))
+        pattern = pattern | pattern.T
+    res = benchmark_reduction(pattern, days=days)
+    print("%8s %10s %10s %12s %12s" % (
+        "nodes", "eliminated", "core", "steps/s", "reduced"))
+    print("%8d %10d %10d %12.0f %12.0f" % (
+        res["n"], res["eliminated"], res["core"], res["steps_per_s"],
+        res["steps_per_s_reduce"]))
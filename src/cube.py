@@ -0,0 +1,294 @@
+'''
+Chunked array store for the SEED outputs.
+
+The SEED outputs for a time level are stored as arrays with dimensions
+    time x pollutant x variable x BA  (production, consumption, total trade
+        and emissions factors, see VARIABLES)
+    time x pollutant x pair of BAs    (interchange, one entry per directed
+        pair of trade partners)
+Pollutant "E" is electricity. Arrays are split in chunks of time steps, each
+saved as a .npy file in the SEED_cube_<time_lev> folder, with a small
+meta.json file with the dimensions. Chunks are memory-mapped when they are
+read, so that a query only reads the chunks of its time range, and within
+these only the data that is needed.
+'''
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+from load import BA_DATA, data_file, read_data
+
+DATA_PATH = os.getenv('DATA_PATH')
+if DATA_PATH is None:
+    raise ValueError("DATA_PATH needs to be set")
+
+VARIABLES = ["NG", "D", "TI", "EF_D", "EF_NG"]
+
+# Number of time steps in a chunk (about a month of hourly data)
+CHUNK_SIZE = 24 * 31
+
+
+def cube_path(time_lev="H"):
+    return os.path.join(DATA_PATH, "analysis", "SEED_cube_%s" % time_lev)
+
+
+def _columns(poll, variable, regions):
+    '''
+    Return the names of the columns of the SEED outputs for poll and
+    variable (see VARIABLES), in the order of regions.
+    '''
+    if variable.startswith("EF_"):
+        if poll == "E":
+            return None
+        return [BA_DATA.KEYS[poll + "i"][variable[3:]] % r for r in regions]
+    return [BA_DATA.KEYS[poll][variable] % r for r in regions]
+
+
+def _labels(index):
+    if isinstance(index, pd.DatetimeIndex):
+        return [str(i) for i in index]
+    if pd.api.types.is_integer_dtype(index):
+        return [int(i) for i in index]
+    return [str(i) for i in index]
+
+
+class CUBE(object):
+    '''
+    Class to read the chunked array store of the SEED outputs for a time
+    level (see makeCube).
+
+    Methods
+    -------
+    get(self, bas, variable, poll, start, end) : slice the BA variables.
+    get_frame(self, bas, variable, poll, start, end) : data frame with the
+        column names of the SEED outputs.
+    get_trade(self, ba, partners, poll, start, end) : interchange of ba with
+        its trade partners.
+
+    Attributes
+    ----------
+    regions, polls, variables : the labels of the dimensions
+    pairs : list of the (ba, ba2) pairs of trade partners
+    index : time index
+    '''
+
+    def __init__(self, time_lev="H", path=None):
+        self.logger = logging.getLogger('load')
+        if path is None:
+            path = cube_path(time_lev)
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as fr:
+            meta = json.load(fr)
+        self.regions = meta["regions"]
+        self.polls = meta["polls"]
+        self.variables = meta["variables"]
+        self.pairs = [tuple(pair) for pair in meta["pairs"]]
+        self.chunk_size = meta["chunk_size"]
+        if meta["time"]:
+            self.index = pd.to_datetime(meta["index"])
+        else:
+            self.index = pd.Index(meta["index"])
+        self._pair_ind = {pair: k for k, pair in enumerate(self.pairs)}
+        self._mmaps = {}
+
+    def _chunk(self, name, k):
+        if (name, k) not in self._mmaps:
+            self._mmaps[(name, k)] = np.load(
+                os.path.join(self.path, "%s_%05d.npy" % (name, k)),
+                mmap_mode='r')
+        return self._mmaps[(name, k)]
+
+    def _read(self, name, start, end, ind):
+        '''
+        Read the rows of the arrays name ("nodes" or "edges") in the time
+        range from start to end (inclusive), indexed by ind along the other
+        axes. Only the chunks that overlap the time range are read.
+        '''
+        steps = range(len(self.index))[self.index.slice_indexer(start, end)]
+        out = []
+        if len(steps) > 0:
+            first, last = steps[0], steps[-1]
+            for k in range(first // self.chunk_size,
+                           last // self.chunk_size + 1):
+                offset = k * self.chunk_size
+                rows = slice(max(first - offset, 0),
+                             min(last - offset, self.chunk_size - 1) + 1)
+                out.append(self._chunk(name, k)[(rows,) + np.ix_(*ind)])
+        if not out:
+            return np.empty((0,) + tuple(len(i) for i in ind)), steps
+        return np.concatenate(out), steps
+
+    @staticmethod
+    def _ind(labels, r):
+        if r is None:
+            return list(range(len(labels)))
+        if isinstance(r, str):
+            r = [r]
+        return [labels.index(ir) for ir in r]
+
+    def get(self, bas=None, variable="D", poll="CO2", start=None, end=None):
+        '''
+        Return a slice of the BA variables, for bas, variable and poll (a
+        label, a list of labels or None for all of them) and the time range
+        from start to end (inclusive). The array has dimensions time x
+        pollutant x variable x BA, and the dimensions given by a single label
+        are dropped.
+        '''
+        data, _ = self._read("nodes", start, end, [
+            self._ind(self.polls, poll), self._ind(self.variables, variable),
+            self._ind(self.regions, bas)])
+        squeeze = tuple(k + 1 for k, r in enumerate([poll, variable, bas])
+                        if isinstance(r, str))
+        return data.squeeze(axis=squeeze) if squeeze else data
+
+    def get_frame(self, bas=None, variable="D", poll="CO2", start=None,
+                  end=None):
+        '''
+        Return a data frame with the BA variables for bas (see get), with
+        the column names of the SEED outputs (see BA_DATA.KEYS).
+        '''
+        polls = self.polls if poll is None else (
+            [poll] if isinstance(poll, str) else poll)
+        variables = self.variables if variable is None else (
+            [variable] if isinstance(variable, str) else variable)
+        bas = self.regions if bas is None else (
+            [bas] if isinstance(bas, str) else bas)
+        data, steps = self._read("nodes", start, end, [
+            self._ind(self.polls, polls), self._ind(self.variables, variables),
+            self._ind(self.regions, bas)])
+        frames = []
+        for p, ip in enumerate(polls):
+            for v, iv in enumerate(variables):
+                cols = _columns(ip, iv, bas)
+                if cols is not None:
+                    frames.append(pd.DataFrame(data[:, p, v], columns=cols))
+        df = pd.concat(frames, axis=1)
+        df.index = self.index[steps.start:steps.stop]
+        return df
+
+    def get_trade(self, ba, partners=None, poll="CO2", start=None, end=None):
+        '''
+        Return a data frame with the interchange (positive if exports) of ba
+        with partners (by default, all its trade partners) for poll and the
+        time range from start to end.
+        '''
+        if partners is None:
+            partners = [ba2 for ba1, ba2 in self.pairs if ba1 == ba]
+        if isinstance(partners, str):
+            partners = [partners]
+        data, steps = self._read("edges", start, end, [
+            self._ind(self.polls, poll),
+            [self._pair_ind[(ba, ba2)] for ba2 in partners]])
+        return pd.DataFrame(data[:, 0], index=self.index[
+            steps.start:steps.stop], columns=partners)
+
+
+def _read_outputs(time_lev, polls, start=None):
+    '''
+    Return a dict with the data frame of the SEED outputs for each poll in
+    polls, and the time index. If start is given, only the rows from start
+    onward are read (see SEED.read_from).
+    '''
+    from SEED import read_from
+    frames = {}
+    for poll in polls:
+        names = ["SEED_E_%s" % time_lev] if poll == "E" else [
+            "SEED_%s_%s" % (poll, time_lev),
+            "SEED_EFs_%s_%s" % (poll, time_lev)]
+        frames[poll] = pd.concat(
+            [read_data(data_file(name, read=True), parse_dates=False)
+             if start is None else read_from(data_file(name, read=True), start)
+             for name in names], axis=1)
+    index = frames["E"].index
+    if index.dtype == object:
+        try:
+            index = pd.to_datetime(index)
+        except (ValueError, TypeError):
+            pass
+    return frames, index
+
+
+def makeCube(time_lev="H", polls=None, update_from=None,
+             chunk_size=CHUNK_SIZE):
+    '''
+    Write the chunked array store for time level time_lev from the SEED
+    outputs for electricity and for polls (by default, all the pollutants
+    for which there are outputs). If update_from is given and the store
+    exists with the same dimensions, only the chunks from the one that
+    contains update_from onward are written again, and only the rows of
+    the outputs for these chunks are read.
+    Returns the CUBE object.
+    '''
+    from SEED import POLLS
+    logger = logging.getLogger('clean')
+    if polls is None:
+        polls = [poll for poll in POLLS if os.path.exists(
+            data_file("SEED_%s_%s" % (poll, time_lev), read=True))]
+    polls = ["E"] + [poll for poll in polls if poll != "E"]
+    logger.info("Writing SEED cube - %s - %s" % (time_lev, ", ".join(polls)))
+
+    path = cube_path(time_lev)
+    first = 0
+    if update_from is not None and os.path.exists(
+            os.path.join(path, "meta.json")):
+        with open(os.path.join(path, "meta.json"), "r") as fr:
+            meta_old = json.load(fr)
+        if meta_old["time"] and meta_old["chunk_size"] == chunk_size:
+            index_old = pd.to_datetime(meta_old["index"])
+            first = min(index_old.searchsorted(pd.Timestamp(update_from)),
+                        len(index_old)) // chunk_size * chunk_size
+
+    # On update, the outputs are read from the last time step that is kept
+    if first > 0:
+        frames, index = _read_outputs(time_lev, polls, index_old[first - 1])
+        if len(index) > 0 and index[0] == index_old[first - 1]:
+            frames = {poll: df.iloc[1:] for poll, df in frames.items()}
+            index = index_old[:first].append(index[1:])
+        else:
+            first = 0
+    if first == 0:
+        frames, index = _read_outputs(time_lev, polls)
+    regions = sorted(set([
+        col.split(".")[1].split("-")[0]
+        for col in frames["E"].columns if col.endswith(".NG.H")]))
+    pairs = sorted(set([
+        (col.split(".")[1].split("-")[0], col.split(".")[1].split("-")[1])
+        for col in frames["E"].columns if col.endswith(".ID.H")]))
+
+    meta = {"regions": regions, "polls": polls, "variables": VARIABLES,
+            "pairs": [list(pair) for pair in pairs], "chunk_size": chunk_size,
+            "time": isinstance(index, pd.DatetimeIndex),
+            "index": _labels(index)}
+    if first > 0 and not all(meta_old[key] == meta[key] for key in [
+            "regions", "polls", "variables", "pairs", "time"]):
+        return makeCube(time_lev, polls, chunk_size=chunk_size)
+    os.makedirs(path, exist_ok=True)
+
+    for start in range(first, len(index), chunk_size):
+        sl = slice(start - first, start - first + chunk_size)
+        n_rows = len(index[start:start + chunk_size])
+        nodes = np.full((n_rows, len(polls), len(VARIABLES), len(regions)),
+                        np.nan)
+        edges = np.full((n_rows, len(polls), len(pairs)), np.nan)
+        for p, poll in enumerate(polls):
+            df = frames[poll].iloc[sl]
+            for v, variable in enumerate(VARIABLES):
+                cols = _columns(poll, variable, regions)
+                if cols is not None:
+                    nodes[:, p, v] = df.reindex(columns=cols).values
+            edges[:, p] = df.reindex(columns=[
+                BA_DATA.KEYS[poll]["ID"] % pair for pair in pairs]).values
+        np.save(os.path.join(path, "nodes_%05d.npy" % (
+            start // chunk_size)), nodes)
+        np.save(os.path.join(path, "edges_%05d.npy" % (
+            start // chunk_size)), edges)
+
+    # Remove the chunks of a previous, longer store
+    n_chunks = -(-len(index) // chunk_size)
+    for fileNm in os.listdir(path):
+        if fileNm.endswith(".npy") and int(fileNm[6:11]) >= n_chunks:
+            os.remove(os.path.join(path, fileNm))
+    with open(os.path.join(path, "meta.json"), "w") as fw:
+        json.dump(meta, fw)
+    return CUBE(path=path)
@@ -7,6 +7,8 @@ The data handler classes provide methods to access the data in different ways
 and perform some checks.
 '''
 import os
+import shutil
+import numpy as np
 import pandas as pd
 import logging
 import re
@@ -16,6 +18,258 @@ DATA_PATH = os.getenv('DATA_PATH')
 if DATA_PATH is None:
     raise ValueError("DATA_PATH needs to be set")
 
+# Length of the time steps of the EBA and SEED data sets, as a pandas offset
+# alias. Set the TIME_STEP environment variable to run on sub-hourly data
+# (e.g. "5min" or "15min"). The AMPD data is hourly, and is split evenly over
+# the sub-hourly time steps (see to_time_step).
+TIME_STEP = os.getenv('TIME_STEP', 'H')
+
+
+def time_steps(year, freq=None):
+    '''
+    Return the timestamps of the time steps of length freq (by default,
+    TIME_STEP) in year.
+    '''
+    if freq is None:
+        freq = TIME_STEP
+    return pd.date_range(pd.Timestamp(year=year, month=1, day=1),
+                         pd.Timestamp(year=year + 1, month=1, day=1),
+                         freq=freq)[:-1]
+
+
+def step_hours(freq=None):
+    '''
+    Return the length of time steps of length freq (by default, TIME_STEP)
+    in hours.
+    '''
+    if freq is None:
+        freq = TIME_STEP
+    return pd.Timedelta(pd.tseries.frequencies.to_offset(freq)).value / 3.6e12
+
+
+def to_time_step(df, freq=None):
+    '''
+    Split hourly totals (e.g. emissions) evenly over time steps of length
+    freq (by default, TIME_STEP). Hourly data is returned unchanged.
+    '''
+    k = int(round(1. / step_hours(freq)))
+    if k <= 1:
+        return df
+    if freq is None:
+        freq = TIME_STEP
+    index = pd.date_range(df.index[0], df.index[-1] + pd.Timedelta(hours=1),
+                          freq=freq)[:-1]
+    return df.reindex(index, method="ffill") / k
+
+
+# Storage format of the intermediate data sets: "csv", "parquet" or
+# "feather". Set the DATA_FORMAT environment variable to use a binary format
+# (this needs pyarrow). Readers detect the format from the file extension.
+# Binary files that are appended to are stored as partitioned data sets: a
+# directory with the extension of the format, with one file per part (see
+# append_data).
+DATA_FORMAT = os.getenv('DATA_FORMAT', 'csv')
+EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+
+
+def data_file(name, fmt=None, read=False):
+    '''
+    Return the path of data set name (e.g. "EBA_3") in DATA_PATH/analysis,
+    with the extension of format fmt (by default, DATA_FORMAT). If read is
+    True and there is no such file, a file for the data set in another
+    format is returned if there is one.
+    '''
+    if fmt is None:
+        fmt = DATA_FORMAT
+    fileNm = os.path.join(DATA_PATH, "analysis", name + EXTENSIONS[fmt])
+    if read and not os.path.exists(fileNm):
+        for ext in EXTENSIONS.values():
+            if os.path.exists(os.path.join(DATA_PATH, "analysis", name + ext)):
+                return os.path.join(DATA_PATH, "analysis", name + ext)
+    return fileNm
+
+
+def file_format(fileNm):
+    '''
+    Return the format of fileNm, from its extension (csv by default).
+    '''
+    ext = os.path.splitext(fileNm)[1]
+    for fmt, ext_fmt in EXTENSIONS.items():
+        if ext == ext_fmt:
+            return fmt
+    return "csv"
+
+
+def data_parts(fileNm):
+    '''
+    Return the sorted paths of the parts of partitioned data set fileNm (see
+    append_data), or [fileNm] if it is a single file.
+    '''
+    if not os.path.isdir(fileNm):
+        return [fileNm]
+    return [os.path.join(fileNm, part) for part in sorted(os.listdir(fileNm))
+            if part.startswith("part_")]
+
+
+def read_data(fileNm, columns=None, index=True, parse_dates=True, **kwargs):
+    '''
+    Read the data frame in fileNm, in the format given by its extension.
+        columns: only read these columns (and the index)
+        index: if True, the first column is the index
+        parse_dates: for csv files, as in pd.read_csv - parquet and feather
+            files keep the types of the columns and of the index
+    Other keyword arguments are passed on to pd.read_csv. The parts of a
+    partitioned data set are read and concatenated.
+    '''
+    if os.path.isdir(fileNm):
+        return pd.concat([read_data(part, columns=columns, index=index,
+                                    parse_dates=parse_dates, **kwargs)
+                          for part in data_parts(fileNm)],
+                         ignore_index=not index)
+    fmt = file_format(fileNm)
+    if fmt == "parquet":
+        df = pd.read_parquet(fileNm, columns=columns)
+        return df if index else df.reset_index(drop=True)
+    elif fmt == "feather":
+        if index or columns is not None:
+            from pyarrow import ipc
+            first = ipc.open_file(fileNm).schema.names[0]
+        if columns is not None:
+            columns = ([first] if index else []) + list(columns)
+        df = pd.read_feather(fileNm, columns=columns)
+        if index:
+            df = df.set_index(first)
+            if first == "index":
+                df.index.name = None
+        return df
+    if columns is not None:
+        first = pd.read_csv(fileNm, nrows=0).columns[0]
+        keep = set(columns) | (set([first]) if index else set())
+        kwargs["usecols"] = lambda col: col in keep
+    if index:
+        kwargs["index_col"] = 0
+    return pd.read_csv(fileNm, parse_dates=parse_dates, **kwargs)
+
+
+def write_data(df, fileNm, index=True):
+    '''
+    Write data frame df to fileNm, in the format given by its extension. If
+    index is False, the index is not saved. A partitioned data set in fileNm
+    is replaced by a single file.
+    '''
+    if os.path.isdir(fileNm):
+        shutil.rmtree(fileNm)
+    fmt = file_format(fileNm)
+    if fmt == "parquet":
+        df.to_parquet(fileNm, index=index)
+    elif fmt == "feather":
+        (df.reset_index() if index else df.reset_index(drop=True)).to_feather(
+            fileNm)
+    else:
+        df.to_csv(fileNm, index=index)
+
+
+def append_data(df, fileNm):
+    '''
+    Append the rows of df (with the same columns) to data file fileNm, with
+    the index. csv files are appended to in place. Binary files are turned
+    into partitioned data sets, and df is written as a new part
+    (part_<k><ext>), so that the existing rows are not read or written
+    again.
+    '''
+    fmt = file_format(fileNm)
+    if fmt == "csv":
+        df.to_csv(fileNm, mode="a", header=not os.path.exists(fileNm))
+        return
+    ext = EXTENSIONS[fmt]
+    if os.path.isfile(fileNm):
+        fileNm_part = fileNm + ".part" + ext
+        os.replace(fileNm, fileNm_part)
+        os.makedirs(fileNm)
+        os.replace(fileNm_part, os.path.join(fileNm, "part_00000" + ext))
+    os.makedirs(fileNm, exist_ok=True)
+    parts = data_parts(fileNm)
+    k = int(os.path.basename(parts[-1])[5:10]) + 1 if parts else 0
+    write_data(df, os.path.join(fileNm, "part_%05d%s" % (k, ext)))
+
+
+def remove_data(fileNm):
+    '''
+    Remove data file or partitioned data set fileNm, if it exists.
+    '''
+    if os.path.isdir(fileNm):
+        shutil.rmtree(fileNm)
+    elif os.path.exists(fileNm):
+        os.remove(fileNm)
+
+
+def replace_data(fileNm_new, fileNm):
+    '''
+    Move data file or partitioned data set fileNm_new to fileNm. Files are
+    replaced atomically. A partitioned data set cannot be: the old data is
+    first moved aside, and only removed once the new data is in place.
+    '''
+    if not (os.path.isdir(fileNm) or os.path.isdir(fileNm_new)):
+        os.replace(fileNm_new, fileNm)
+        return
+    fileNm_old = fileNm + ".old" + os.path.splitext(fileNm)[1]
+    remove_data(fileNm_old)
+    if os.path.exists(fileNm):
+        os.replace(fileNm, fileNm_old)
+    os.replace(fileNm_new, fileNm)
+    remove_data(fileNm_old)
+
+
+def check_storage(fmt=None, path=None):
+    '''
+    Round-trip check of the storage layer for format fmt (by default,
+    DATA_FORMAT), in directory path (by default a temporary directory):
+    a frame with a time index is written, appended to, and read back, in
+    full and with a projection of the columns (e.g. to check a pyarrow
+    installation before setting DATA_FORMAT). Raises a ValueError if the
+    data read back is not the data written.
+    '''
+    import tempfile
+    if fmt is None:
+        fmt = DATA_FORMAT
+    index = pd.date_range("2018-07-01", periods=48, freq="H")
+    df = pd.DataFrame({"EBA.A-ALL.D.H": np.arange(48.),
+                       "EBA.A-B.ID.H": -np.arange(48.) / 3,
+                       "EBA.B-A.ID.H": np.arange(48.) / 3}, index=index)
+    with tempfile.TemporaryDirectory(dir=path) as tmp:
+        fileNm = os.path.join(tmp, "check" + EXTENSIONS[fmt])
+        write_data(df.iloc[:24], fileNm)
+        checks = [("write", read_data(fileNm), df.iloc[:24])]
+        append_data(df.iloc[24:36], fileNm)
+        append_data(df.iloc[36:], fileNm)
+        checks += [
+            ("append", read_data(fileNm), df),
+            ("columns", read_data(fileNm, columns=["EBA.B-A.ID.H"]),
+             df.loc[:, ["EBA.B-A.ID.H"]]),
+            ("index", read_data(fileNm, columns=[]).index, df.index)]
+        for name, df_read, df_ref in checks:
+            if isinstance(df_ref, pd.Index):
+                ok = pd.DatetimeIndex(df_read).equals(df_ref)
+            else:
+                df_read.index = pd.Index(df_read.index)
+                # read_csv can be off by one ulp
+                ok = (list(df_read.columns) == list(df_ref.columns)) and (
+                    np.allclose(df_read.values, df_ref.values, rtol=1e-12,
+                                atol=0.)) and (
+                    df_read.index.equals(df_ref.index))
+            if not ok:
+                raise ValueError("Storage check failed for %s: %s" % (
+                    fmt, name))
+
+
+def convert_data(name, fmt="csv"):
+    '''
+    Save data set name (see data_file) in format fmt, e.g. to export a data
+    set saved in a binary format to csv.
+    '''
+    fileNm = data_file(name, read=True)
+    write_data(read_data(fileNm), data_file(name, fmt=fmt))
+
 
 class BA_DATA(object):
     '''Class to handle BA-level data. The EBA class provides generation,
@@ -42,11 +296,23 @@ class BA_DATA(object):
     Methods
     -------
     get_cols(self, r) : generate column names for regions r for a given field.
+    get_loc(self, ba, field, ba2) : position of a column, from the column
+        index that is parsed once and cached.
+    get_arrays(self, fields) : (T, n) arrays for D, NG, TI and (T, n, n)
+        interchange tensor.
+    set_arrays(self, arrays) : write arrays back to the data frame.
+    use_edges(self), use_columns(self) : store interchange data as an
+        EDGES object or as columns of df.
+    get_frame(self) : data frame with all the columns, including the
+        interchange stored as edges.
+    checkAll(self) : vectorized sanity checks for all BAs.
 
     Attributes
     ----------
     regions : are in alphabetical order
     df : raw dataframe
+    edges : EDGES object with the interchange data, if use_edges was called
+        (None otherwise) - the ID columns are then not in df
     '''
     # Convenience dictionary to refer to keys
     # call KEY['D']%ri to get demand for region ri
@@ -63,23 +329,25 @@ class BA_DATA(object):
             "NOXi": {'D': "NOXi_%s_D", 'NG': "NOXi_%s_NG"}}
 
     def __init__(self, step=None, fileNm=None, df=None, variable="E",
-                 dataset="EBA"):
+                 dataset="EBA", edges=False):
         self.logger = logging.getLogger('load')
+        self.edges = None
 
         if df is not None:
             self.df = df
         else:
             if step is not None:
-                fileNm = os.path.join(
-                    DATA_PATH, 'analysis', '%s_%d.csv' % (dataset, step))
+                fileNm = data_file('%s_%d' % (dataset, step), read=True)
             if fileNm is None:
-                fileNm = os.path.join(DATA_PATH, "analysis", "EBA_0.csv")
-            self.df = pd.read_csv(fileNm, index_col=0, parse_dates=True)
+                fileNm = data_file("EBA_0", read=True)
+            self.df = read_data(fileNm)
 
         self.variable = variable
         self.regions = self._parse_data_cols()
         self.fileNm = fileNm
         self.KEY = self.KEYS[variable]
+        if edges:
+            self.use_edges()
 
     def get_cols(self, r=None, field="D"):
         if r is None:
@@ -89,12 +357,51 @@ class BA_DATA(object):
         return [self.KEY[field] % ir for ir in r]
 
     def get_trade_partners(self, ba):
-        partners = []
-        for ba2 in self.regions:
-            if ((self.KEY["ID"] % (ba, ba2) in self.df.columns)
-                    and (self.KEY["ID"] % (ba2, ba) in self.df.columns)):
-                partners += [ba2]
-        return partners
+        index = self._col_index()
+        if ba not in index["partners"]:
+            index["partners"][ba] = [
+                ba2 for ba2 in self.regions if (ba, ba2) in index["ID"]
+                and (ba2, ba) in index["ID"]]
+        return index["partners"][ba]
+
+    def get_loc(self, ba, field="D", ba2=None):
+        '''
+        Return the position of the column for field and region ba (or for
+        the interchange between ba and ba2), or None if there is no such
+        column (or if interchange is stored as edges).
+        '''
+        index = self._col_index()
+        if ba2 is not None:
+            return index["ID"].get((ba, ba2))
+        return index["fields"].get((field, ba))
+
+    def _col_index(self):
+        '''
+        Return the index of the columns of df, parsed once: positions by
+        (field, region) and by pair of regions for interchange, and cached
+        trade partners. The index is rebuilt when the columns change (adding
+        a column to a DataFrame creates a new columns object). Pairs stored
+        as edges are in the index, without a position.
+        '''
+        index = getattr(self, "_index", None)
+        if (index is not None and index["columns"] is self.df.columns
+                and index["edges"] is self.edges):
+            return index
+        index = {"columns": self.df.columns, "edges": self.edges,
+                 "fields": {}, "ID": {}, "regions": set(), "partners": {}}
+        if self.edges is not None:
+            for pair in self.edges.get_pairs():
+                index["ID"][pair] = None
+        for k, col in enumerate(self.df.columns):
+            parts = re.split(r"\.|-|_", col)
+            index["regions"].add(parts[1])
+            if "ID" in parts:
+                index["ID"][(parts[1], parts[2])] = k
+            for field in ["D", "NG", "TI"]:
+                if field in parts:
+                    index["fields"][(field, parts[1])] = k
+        self._index = index
+        return index
 
     def _parse_data_cols(self):
         '''
@@ -103,17 +410,13 @@ class BA_DATA(object):
             interchange / trade matrix
         Returns the list of regions
         '''
-        regions = set([re.split(r"\.|-|_", el)[1] for el in self.df.columns])
-        D_cols = [re.split(r"\.|-|_", el)[1] for el in self.df.columns if 'D'
-                  in re.split(r"\.|-|_", el)]
-        NG_cols = [re.split(r"\.|-|_", el)[1] for el in self.df.columns if 'NG'
-                   in re.split(r"\.|-|_", el)]
-        TI_cols = [re.split(r"\.|-|_", el)[1] for el in self.df.columns if 'TI'
-                   in re.split(r"\.|-|_", el)]
-        ID_cols = [re.split(r"\.|-|_", el)[1] for el in self.df.columns if 'ID'
-                   in re.split(r"\.|-|_", el)]
-        ID_cols2 = [re.split(r"\.|-|_", el)[2] for el in self.df.columns if
-                    'ID' in re.split(r"\.|-|_", el)]
+        index = self._col_index()
+        regions = index["regions"]
+        D_cols = [ba for field, ba in index["fields"] if field == "D"]
+        NG_cols = [ba for field, ba in index["fields"] if field == "NG"]
+        TI_cols = [ba for field, ba in index["fields"] if field == "TI"]
+        ID_cols = [ba for ba, _ in index["ID"]]
+        ID_cols2 = [ba2 for _, ba2 in index["ID"]]
 
         if len(NG_cols) != len(D_cols):
             self.logger.warn(
@@ -136,15 +439,199 @@ class BA_DATA(object):
         return sorted(list(regions))
 
     def get_trade_out(self, r=None):
+        if self.edges is not None:
+            raise ValueError("Interchange is stored as edges, not as columns"
+                             " of df: call use_columns first")
         if r is None:
             r = self.regions
         if isinstance(r, str):
             r = [r]
+        index = self._col_index()
         cols = []
         for ir2 in self.regions:
-            cols += [self.KEY['ID'] % (ir, ir2) for ir in r]
-        return [c for c in cols if c in self.df.columns]
+            cols += [self.KEY['ID'] % (ir, ir2) for ir in r
+                     if (ir, ir2) in index["ID"]]
+        return cols
 
+    def use_edges(self):
+        '''
+        Move the interchange columns of df to an EDGES object, self.edges.
+        '''
+        if self.edges is not None:
+            return
+        index = self._col_index()
+        cols = [self.df.columns[k] for k in sorted(index["ID"].values())]
+        self._all_columns = list(self.df.columns)
+        self.edges = EDGES(self.df.loc[:, cols], self.regions, self.KEY)
+        self.df = self.df.drop(columns=cols)
+
+    def use_columns(self):
+        '''
+        Move interchange data stored as edges back to columns of df, in
+        their original positions (columns added in the meantime are last).
+        '''
+        if self.edges is None:
+            return
+        self.df = self.get_frame()
+        self.edges = None
+
+    def get_frame(self):
+        '''
+        Return df with the interchange stored as edges as columns, in their
+        original positions (columns added in the meantime are last).
+        '''
+        if self.edges is None:
+            return self.df
+        df = pd.concat([self.df, self.edges.to_frame()], axis=1)
+        cols = [c for c in self._all_columns if c in df.columns]
+        return df.loc[:, cols + [c for c in df.columns if c not in cols]]
+
+    def _get_col(self, col):
+        '''
+        Return column col of df, or of the interchange stored as edges.
+        '''
+        if self.edges is not None and col in self.edges.columns:
+            return self.edges.to_frame([col])[col]
+        return self.df.loc[:, col]
+
+    def _locs(self, df, field):
+        '''
+        Return the positions in df of the columns for field, for the regions
+        in self.regions (or pairs of regions for ID), -1 if missing.
+        '''
+        if field == "ID":
+            names = [self.KEY["ID"] % (ri, rj) for ri in self.regions
+                     for rj in self.regions]
+        else:
+            names = self.get_cols(field=field)
+        if df is self.df:
+            index = self._col_index()
+            if field == "ID":
+                locs = [index["ID"].get((ri, rj)) for ri in self.regions
+                        for rj in self.regions]
+                return np.array([-1 if k is None else k for k in locs],
+                                dtype=int)
+            return np.array([index["fields"].get((field, ri), -1)
+                             for ri in self.regions], dtype=int)
+        return df.columns.get_indexer(names)
+
+    def get_arrays(self, fields=("D", "NG", "TI", "ID"), df=None):
+        '''
+        Return a dict of numpy arrays for fields, with regions in the order
+        of self.regions:
+            D, NG, TI: (T, n) arrays, NaN for missing columns
+            ID: (T, n, n) array - ID[t, i, j] is from region i to j, zero
+                for pairs that do not trade
+        df defaults to self.df, and can be another frame with the same
+        column names. If interchange is stored as edges, ID is read from the
+        edges for self.df, and otherwise from the columns of df for the
+        stored edges only (the other direction of antisymmetric pairs is
+        not read), or from the edges if df has none of these columns but
+        the same time index. The (T, n) arrays are
+        views on the data of the frame (so that writes reach the frame) when
+        it has a single dtype and the columns are evenly spaced; otherwise
+        they are copies, and changes should be written back with set_arrays.
+        '''
+        if df is None:
+            df = self.df
+        values = df.values
+        n = len(self.regions)
+        arrays = {}
+        for field in fields:
+            if field == "ID" and self.edges is not None:
+                locs = df.columns.get_indexer(self.edges.edge_columns)
+                if df is not self.df and (locs >= 0).all():
+                    arrays[field] = self.edges.to_dense(values[:, locs])
+                    continue
+                if df is self.df or ((locs < 0).all()
+                                     and df.index.equals(self.edges.index)):
+                    arrays[field] = self.edges.to_dense()
+                    continue
+            locs = self._locs(df, field)
+            if field == "ID":
+                ID = np.zeros((len(df), n * n))
+                ok = locs >= 0
+                ID[:, ok] = values[:, locs[ok]]
+                arrays[field] = ID.reshape((len(df), n, n))
+                continue
+            step = np.diff(locs)
+            if (locs >= 0).all() and n > 0 and (
+                    (n == 1) or ((step > 0).all() and (step == step[0]).all())):
+                arrays[field] = values[:, locs[0]:locs[-1] + 1:(
+                    step[0] if n > 1 else 1)]
+            else:
+                arrays[field] = np.full((len(df), n), np.nan)
+                ok = locs >= 0
+                arrays[field][:, ok] = values[:, locs[ok]]
+        return arrays
+
+    def set_arrays(self, arrays, df=None):
+        '''
+        Write the arrays in dict arrays (see get_arrays) back to the existing
+        columns of df (by default self.df).
+        '''
+        if df is None:
+            df = self.df
+        for field, arr in arrays.items():
+            if field == "ID" and df is self.df and self.edges is not None:
+                self.edges.set_dense(arr)
+                continue
+            locs = self._locs(df, field)
+            if field == "ID":
+                arr = arr.reshape((len(df), -1))
+            ok = locs >= 0
+            if ok.any():
+                df.iloc[:, locs[ok]] = arr[:, ok]
+
+    def checkAll(self, tol=1e-2, log_level=logging.INFO):
+        '''
+        Sanity checks of checkBA for all BAs at once, on the array view of
+        the data.
+        '''
+        logger = self.logger
+        log_level_old = logger.level
+        logger.setLevel(log_level)
+        arrays = self.get_arrays()
+        index = self._col_index()
+        partners = np.array([[(ri, rj) in index["ID"] and (rj, ri) in index[
+            "ID"] for rj in self.regions] for ri in self.regions], dtype=bool)
+        ID = np.where(partners, arrays["ID"], 0.)
+
+        # NaNs
+        for field in ["D", "NG", "TI"]:
+            cnt_na = np.isnan(arrays[field]).sum(axis=0)
+            for i in np.flatnonzero(cnt_na):
+                logger.error("There are still %d nans for %s field %s" %
+                             (cnt_na[i], self.regions[i], field))
+        cnt_na = (np.isnan(arrays["ID"]) & partners).sum(axis=0)
+        for i, j in zip(*np.nonzero(cnt_na)):
+            logger.error("There are still %d nans for %s-%s" %
+                         (cnt_na[i, j], self.regions[i], self.regions[j]))
+
+        with np.errstate(invalid='ignore'):
+            # TI+D == NG
+            res1 = arrays["NG"] - (arrays["D"] + arrays["TI"])
+            for i in np.flatnonzero((np.abs(res1) > tol).any(axis=0)):
+                logger.error("%s: TI+D == NG violated" % self.regions[i])
+
+            # TI == ID.sum()
+            res2 = arrays["TI"] - np.nansum(ID, axis=2)
+            for i in np.flatnonzero((np.abs(res2) > tol).any(axis=0)):
+                logger.error("%s: TI == ID.sum()violated" % self.regions[i])
+
+            # ID[i,j] == -ID[j,i]
+            res3 = (np.abs(ID + ID.transpose((0, 2, 1))) > tol).any(axis=0)
+            for i, j in zip(*np.nonzero(res3 & partners)):
+                logger.error("%s-%s: ID[i,j] == -ID[j,i] violated" % (
+                    self.regions[i], self.regions[j]))
+
+            # D and NG negative
+            for field in ["D", "NG"]:
+                cnt_neg = (arrays[field] < 0).sum(axis=0)
+                for i in np.flatnonzero(cnt_neg):
+                    logger.error("%s: there are %d <0 values for field %s" %
+                                 (self.regions[i], cnt_neg[i], field))
+        logger.setLevel(log_level_old)
 
     def checkBA(self, ba, tol=1e-2, log_level=logging.INFO):
         '''
@@ -165,7 +652,7 @@ class BA_DATA(object):
                              (cnt_na, ba, field))
     
         for ba2 in partners:
-            cnt_na = self.df.loc[:, self.KEY["ID"] % (ba, ba2)].isna().sum()
+            cnt_na = self._get_col(self.KEY["ID"] % (ba, ba2)).isna().sum()
             if cnt_na != 0:
                 logger.error("There are still %d nans for %s-%s" %
                              (cnt_na, ba, ba2))
@@ -178,17 +665,17 @@ class BA_DATA(object):
             logger.error("%s: TI+D == NG violated" % ba)
     
         # TI == ID.sum()
+        ID = [self._get_col(self.KEY["ID"] % (ba, ba2)) for ba2 in partners]
         res2 = (
             self.df.loc[:, self.get_cols(r=ba, field="TI")[0]]
-            - self.df.loc[:, [self.KEY["ID"] % (ba, ba2) for ba2 in partners]]\
-                .sum(axis=1))
+            - (pd.concat(ID, axis=1).sum(axis=1) if ID else 0.))
         if (res2.abs() > tol).sum() != 0:
             logger.error("%s: TI == ID.sum()violated" % ba)
     
         # ID[i,j] == -ID[j,i]
         for ba2 in partners:
-            res3 = (self.df.loc[:, self.KEY["ID"] % (ba, ba2)] 
-                    + self.df.loc[:, self.KEY["ID"] % (ba2, ba)])
+            res3 = (self._get_col(self.KEY["ID"] % (ba, ba2))
+                    + self._get_col(self.KEY["ID"] % (ba2, ba)))
             if (res3.abs() > tol).sum() != 0:
                 logger.error("%s-%s: ID[i,j] == -ID[j,i] violated" % (ba, ba2))
     
@@ -202,6 +689,120 @@ class BA_DATA(object):
         logger.setLevel(log_level_old)
 
 
+class EDGES(object):
+    '''
+    Class to handle interchange data as an edge list: an (E, 2) array of
+    pairs of regions and a (T, E) array of values, instead of one column per
+    directed pair. Pairs for which ID[j, i] == -ID[i, j] at all times are
+    stored once. The conversion to and from columns is exact, up to the sign
+    of zeros: the other pairs (e.g. in raw data) are stored as directed
+    edges, and the column names and order are kept.
+
+    Methods
+    -------
+    to_frame(self, columns) : data frame with one column per directed pair.
+    to_dense(self, values) : (T, n, n) interchange tensor.
+    set_dense(self, ID) : update the values from a (T, n, n) tensor.
+    get_pairs(self) : list of the directed pairs of regions.
+
+    Attributes
+    ----------
+    pairs : (E, 2) array of region indices (i, j) - values are ID[i, j]
+    antisym : (E,) boolean array - True if the edge also stores ID[j, i]
+    values : (T, E) array
+    edge_columns : names of the E columns of the stored edges
+    '''
+
+    def __init__(self, df, regions, KEY):
+        '''
+        df: data frame with the interchange columns
+        regions: list of regions, for the indices in pairs
+        KEY: column names (see BA_DATA.KEYS)
+        '''
+        self.regions = list(regions)
+        self.KEY = KEY
+        self.index = df.index
+        self.columns = list(df.columns)
+        ind = {r: i for i, r in enumerate(self.regions)}
+        names = {}
+        for col in self.columns:
+            parts = re.split(r"\.|-|_", col)
+            names[(parts[1], parts[2])] = col
+
+        pairs, antisym, cols, stored = [], [], [], set()
+        for (ri, rj), col in names.items():
+            if (ri, rj) in stored:
+                continue
+            rev = names.get((rj, ri))
+            sym = rev is not None and self._is_neg(
+                df[col].values, df[rev].values)
+            if sym:
+                stored.add((rj, ri))
+            pairs.append((ind[ri], ind[rj]))
+            antisym.append(sym)
+            cols.append(col)
+        self.pairs = np.array(pairs, dtype=int).reshape((-1, 2))
+        self.antisym = np.array(antisym, dtype=bool)
+        self.values = df.loc[:, cols].values
+        self.edge_columns = cols
+        # Position of the edge for each column, and whether it is reversed
+        self._col_edges = {}
+        for k, (i, j) in enumerate(self.pairs):
+            ri, rj = self.regions[i], self.regions[j]
+            self._col_edges[KEY["ID"] % (ri, rj)] = (k, False)
+            if self.antisym[k]:
+                self._col_edges[KEY["ID"] % (rj, ri)] = (k, True)
+
+    @staticmethod
+    def _is_neg(a, b):
+        '''
+        True if b == -a, or NaN where a is NaN.
+        '''
+        return bool(((b == -a) | (np.isnan(a) & np.isnan(b))).all())
+
+    def get_pairs(self):
+        pairs = [(self.regions[i], self.regions[j]) for i, j in self.pairs]
+        return pairs + [(self.regions[j], self.regions[i]) for i, j in
+                        self.pairs[self.antisym]]
+
+    def to_frame(self, columns=None):
+        '''
+        Return the data frame with the columns in columns (by default, all of
+        them).
+        '''
+        if columns is None:
+            columns = self.columns
+        data = {}
+        for col in columns:
+            k, rev = self._col_edges[col]
+            data[col] = -self.values[:, k] if rev else self.values[:, k]
+        return pd.DataFrame(data, index=self.index, columns=columns)
+
+    def to_dense(self, values=None):
+        '''
+        Return the (T, n, n) interchange tensor for the edge values values, a
+        (T', E) array with the stored edges as columns (by default
+        self.values), e.g. the rows of a chunk of time steps.
+        '''
+        if values is None:
+            values = self.values
+        n = len(self.regions)
+        ID = np.zeros((len(values), n, n))
+        ID[:, self.pairs[:, 0], self.pairs[:, 1]] = values
+        sym = self.pairs[self.antisym]
+        ID[:, sym[:, 1], sym[:, 0]] = -values[:, self.antisym]
+        return ID
+
+    def set_dense(self, ID):
+        ind = {r: i for i, r in enumerate(self.regions)}
+        data = {}
+        for col in self.columns:
+            parts = re.split(r"\.|-|_", col)
+            data[col] = ID[:, ind[parts[1]], ind[parts[2]]]
+        self.__init__(pd.DataFrame(data, index=self.index), self.regions,
+                      self.KEY)
+
+
 class AMPD(object):
     '''
     Class to handle the AMPD data.
@@ -211,16 +812,17 @@ class AMPD(object):
         self.logger = logging.getLogger('load')
 
         if step is not None:
-            fileNm = os.path.join(DATA_PATH, 'analysis', 'AMPD_%d.csv' % step)
+            fileNm = data_file('AMPD_%d' % step, read=True)
         if fileNm is None:
-            fileNm = os.path.join(DATA_PATH, 'analysis', 'AMPD_0.csv')
+            fileNm = data_file('AMPD_0', read=True)
 
         self.fileNm = fileNm
         if step < 2:
-            self.df = pd.read_csv(fileNm, parse_dates=['OP_DATE_TIME'],
-                                  infer_datetime_format=True)
+            self.df = read_data(fileNm, index=False,
+                                parse_dates=['OP_DATE_TIME'],
+                                infer_datetime_format=True)
         elif step == 2:
-            self.df = pd.read_csv(fileNm, index_col=0, parse_dates=True)
+            self.df = read_data(fileNm)
 
         self.logger.info('Loading AMPD from %s' % self.fileNm)
 
@@ -0,0 +1,160 @@
+'''
+Marginal emission factors.
+
+Marginal emission factors are estimated for each BA as the slope of the
+hourly changes in emissions produced (delta F) on the hourly changes in
+generation (delta NG), and for consumption as the slope of the changes in
+consumption emissions on the changes in demand. Regressions for all BAs and
+all windows or groups are solved at once from sums of the aligned arrays:
+cumulative sums for rolling windows, and a sparse group indicator matrix for
+groups (e.g. season and hour of day).
+'''
+import os
+import logging
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from load import data_file, step_hours, write_data
+from SEED import (consumption_emissions_batch, fill_SEED_data, load_SEED_data,
+                  trade_arrays, trade_pattern)
+
+DATA_PATH = os.getenv('DATA_PATH')
+if DATA_PATH is None:
+    raise ValueError("DATA_PATH needs to be set")
+
+SEASONS = {12: "DJF", 1: "DJF", 2: "DJF", 3: "MAM", 4: "MAM", 5: "MAM",
+           6: "JJA", 7: "JJA", 8: "JJA", 9: "SON", 10: "SON", 11: "SON"}
+
+
+def _ols(n, Sx, Sy, Sxx, Sxy, Syy, min_obs=3):
+    '''
+    Return the slopes and coefficients of determination of the least squares
+    regressions of y on x (with an intercept), from the number of
+    observations and the sums of x, y, x^2, xy and y^2 (arrays of the same
+    shape). Regressions with less than min_obs observations or no variance
+    in x are NaN.
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vx = n * Sxx - Sx ** 2
+        vy = n * Syy - Sy ** 2
+        cxy = n * Sxy - Sx * Sy
+        slope = cxy / vx
+        r2 = cxy ** 2 / (vx * vy)
+    bad = (n < min_obs) | ~(vx > 0)
+    slope[bad] = np.nan
+    r2[bad] = np.nan
+    return slope, r2
+
+
+def _moments(x, y):
+    '''
+    Return the arrays to sum for the regressions of y on x: observation
+    indicator, x, y, x^2, xy and y^2. Missing observations are zeroed, and
+    the series are centered to limit cancellation in the sums.
+    '''
+    ok = ~(np.isnan(x) | np.isnan(y))
+    x = np.where(ok, x - np.nanmean(x, axis=0), 0.)
+    y = np.where(ok, y - np.nanmean(y, axis=0), 0.)
+    return [ok.astype(float), x, y, x * x, x * y, y * y]
+
+
+def rolling_mef(x, y, window, min_obs=3):
+    '''
+    Marginal factors over rolling windows.
+        x, y: (T, n) arrays of changes in generation (or demand) and in
+            emissions, with NaNs for missing observations
+        window: number of time steps in each window
+    Returns the (T, n) arrays of slopes and coefficients of determination
+    for the windows ending at each time step.
+    '''
+    sums = []
+    for m in _moments(x, y):
+        c = np.concatenate([np.zeros((1,) + m.shape[1:]), np.cumsum(m, 0)])
+        s = c[1:].copy()
+        s[window:] -= c[1:-window]
+        sums.append(s)
+    return _ols(*sums, min_obs=min_obs)
+
+
+def grouped_mef(x, y, keys, min_obs=3):
+    '''
+    Marginal factors by group.
+        x, y: (T, n) arrays (see rolling_mef)
+        keys: (T,) array of group labels
+    Returns the sorted group labels, and the (G, n) arrays of slopes and
+    coefficients of determination.
+    '''
+    labels, inv = np.unique(keys, return_inverse=True)
+    M = sparse.csr_matrix((np.ones(len(inv)), (inv, np.arange(len(inv)))),
+                          shape=(len(labels), len(inv)))
+    sums = [M.dot(m) for m in _moments(x, y)]
+    slope, r2 = _ols(*sums, min_obs=min_obs)
+    return labels, slope, r2
+
+
+def season_hour(index):
+    '''
+    Return the season - hour of day labels of the time steps in index.
+    '''
+    return np.array(["%s-%02d" % (SEASONS[m], h)
+                     for m, h in zip(index.month, index.hour)])
+
+
+def makeMEF(poll="CO2", window=24 * 30, consumption=False, df_j=None,
+            eba=None, min_obs=3, **kwargs):
+    '''
+    Estimate marginal emission factors for pollutant poll and save them in
+    SEED_MEFs_<poll>_rolling.csv (windows of window hours, labeled by their
+    last time step) and SEED_MEFs_<poll>_season_hour.csv. Columns are
+    <poll>_<BA>_MEF for production and, if consumption is True,
+    <poll>i_<BA>_MEF for consumption, in kg/MWh, as well as the
+    corresponding coefficients of determination (suffix _R2). Consumption
+    emissions are calculated by solving the trade system; other keyword
+    arguments are passed on to consumption_emissions_batch.
+    Changes are calculated from the unfilled inputs: the values that are
+    filled in fill_SEED_data (NAs and zeros) are missing observations.
+    '''
+    logger = logging.getLogger('clean')
+    logger.info("Starting marginal emission factors - %s" % poll)
+    # The raw inputs are loaded once, and filled on a copy
+    raw, eba_raw = load_SEED_data([poll], fill=False)
+    if df_j is None:
+        df_j, eba = fill_SEED_data(raw.copy(), [poll]), eba_raw
+    raw = raw.reindex(df_j.index)
+
+    def unfilled(cols):
+        values = raw.loc[:, cols].values
+        return np.where(values == 0., np.nan, values)
+
+    F_cols = ["%s_%s_NG" % (poll, ba) for ba in eba.regions]
+    series = [("%s_%%s" % poll,
+               np.diff(unfilled(eba.get_cols(field="NG")), axis=0),
+               np.diff(unfilled(F_cols), axis=0))]
+    if consumption:
+        P, ID = trade_arrays(df_j, eba)
+        X, _ = consumption_emissions_batch(
+            df_j.loc[:, F_cols].values, P, ID, pattern=trade_pattern(eba),
+            **kwargs)
+        D = unfilled(eba.get_cols(field="D"))
+        series += [("%si_%%s" % poll, np.diff(D, axis=0),
+                    np.diff(X * D, axis=0))]
+
+    # Hourly changes are labeled by the later time step
+    index = df_j.index[1:]
+    rolling = {}
+    grouped = {}
+    for name, x, y in series:
+        slope, r2 = rolling_mef(x, y, int(round(window / step_hours())),
+                                min_obs=min_obs)
+        labels, g_slope, g_r2 = grouped_mef(x, y, season_hour(index),
+                                            min_obs=min_obs)
+        for i, ba in enumerate(eba.regions):
+            rolling[name % ba + "_MEF"] = 1000 / step_hours() * slope[:, i]
+            rolling[name % ba + "_R2"] = r2[:, i]
+            grouped[name % ba + "_MEF"] = 1000 / step_hours() * g_slope[:, i]
+            grouped[name % ba + "_R2"] = g_r2[:, i]
+
+    write_data(pd.DataFrame(rolling, index=index),
+               data_file("SEED_MEFs_%s_rolling" % poll))
+    write_data(pd.DataFrame(grouped, index=labels),
+               data_file("SEED_MEFs_%s_season_hour" % poll))
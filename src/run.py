@@ -12,6 +12,7 @@ from AMPD_0 import AMPD_0
 from AMPD_1 import AMPD_1
 from AMPD_2 import AMPD_2
 from SEED import SEED
+from load import check_storage
 
 DATA_PATH = os.getenv('DATA_PATH')
 if DATA_PATH is None:
@@ -0,0 +1,189 @@
+'''
+What-if scenarios for consumption emissions.
+
+The consumption system A X = F is factorized once for all time steps (the
+stacked inverses are cached). Scenarios that only change production emissions
+only change the right-hand side and are evaluated with matrix products
+against the cached inverses. Scenarios that change a few trade links change
+a few rows of A, and are evaluated with low-rank Sherman-Morrison-Woodbury
+updates of the cached inverses instead of new solves.
+'''
+import os
+import logging
+import numpy as np
+from SEED import (_solve_dense, _system, aggregate_time, load_SEED_data,
+                  trade_arrays)
+
+DATA_PATH = os.getenv('DATA_PATH')
+if DATA_PATH is None:
+    raise ValueError("DATA_PATH needs to be set")
+
+
+class SCENARIOS(object):
+    '''
+    Class to evaluate what-if scenarios on top of a base case.
+
+    A scenario is a dict with optional entries:
+        "F": dict mapping BAs to factors (scalars or (T,) arrays) by which
+            their production emissions are multiplied, or a (T, n) array of
+            production emissions
+        "ID": dict mapping pairs of BAs (ba1, ba2) to factors by which the
+            interchange on the link between them is multiplied
+
+    Methods
+    -------
+    emissions(self, F) : consumption emissions intensities for a stack of
+        production emissions, reusing the cached inverses.
+    trade(self, links, F) : consumption emissions intensities for changed
+        trade links, using low-rank updates.
+    run(self, scenarios) : evaluate a list of scenarios.
+    '''
+
+    def __init__(self, F, P, ID, D, regions, index=None):
+        '''
+        F: (T, n) array of emissions produced
+        P: (T, n) array of generation
+        ID: (T, n, n) array of interchange
+        D: (T, n) array of demand
+        regions: list of BAs
+        '''
+        self.logger = logging.getLogger('clean')
+        self.F = np.asarray(F, dtype=float)
+        self.P = P
+        self.ID = ID
+        self.regions = list(regions)
+        self.index = index
+        self.diag, self.Imp, _, self.perturbed = _system(F, P, ID)
+        self.D = np.asarray(D, dtype=float)
+
+        # Cache the inverses, with one factorization per time step - time
+        # steps for which the system is singular are left as NaNs
+        n = P.shape[1]
+        idx = np.arange(n)
+        A = -self.Imp
+        A[:, idx, idx] += self.diag
+        self.Ainv = _solve_dense(A, np.broadcast_to(np.eye(n), A.shape))
+        self.X = self.emissions(self.F)
+
+    def emissions(self, F, perturbed=None):
+        '''
+        Return the consumption emissions intensities for production
+        emissions F, a (T, n) array or a (S, T, n) stack of arrays, reusing
+        the cached inverses. The S scenarios are solved together as
+        right-hand sides with the same matrix for each time step.
+        '''
+        if perturbed is None:
+            perturbed = self.perturbed
+        b = np.array(F, dtype=float)
+        b[..., perturbed] = 0.
+        if b.ndim == 2:
+            return np.matmul(self.Ainv, b[:, :, np.newaxis])[:, :, 0]
+        return np.matmul(self.Ainv, b.transpose((1, 2, 0))).transpose(
+            (2, 0, 1))
+
+    def _scale_F(self, spec):
+        if spec is None:
+            return self.F
+        if not isinstance(spec, dict):
+            return np.asarray(spec, dtype=float)
+        F = self.F.copy()
+        for ba, factor in spec.items():
+            F[:, self.regions.index(ba)] *= factor
+        return F
+
+    def _rows(self, links):
+        '''
+        Return the rows R of the system that are changed by links, the
+        corresponding rows of interchange after the change, and the change
+        in the rows R of the system matrix.
+        '''
+        pairs = [(self.regions.index(ba1), self.regions.index(ba2))
+                 for ba1, ba2 in links]
+        R = sorted(set([i for pair in pairs for i in pair]))
+        loc = {r: k for k, r in enumerate(R)}
+        ID_R = self.ID[:, R].copy()
+        for (i, j), factor in zip(pairs, links.values()):
+            ID_R[:, loc[i], j] *= factor
+            ID_R[:, loc[j], i] *= factor
+
+        # Rebuild rows R of the system, with the same perturbation of
+        # isolated nodes as in _system
+        Imp_R = (-ID_R).clip(min=0)
+        dImp = Imp_R - self.Imp[:, R]
+        colsum = self.Imp[:, :, R].sum(axis=1) + dImp[:, :, R].sum(axis=1)
+        diag_R = np.abs(self.P[:, R] + Imp_R.sum(axis=2))
+        pert_R = ((diag_R + Imp_R.sum(axis=2) == 0)
+                  & (diag_R + colsum == 0))
+        diag_R = self.P[:, R] + Imp_R.sum(axis=2)
+        diag_R[pert_R] = 1.
+        dA = -dImp
+        dA[:, np.arange(len(R)), R] += diag_R - self.diag[:, R]
+        return R, ID_R, dA, pert_R
+
+    def trade(self, links, F=None):
+        '''
+        Return the consumption emissions intensities and demand after
+        multiplying the interchange on the links between pairs of BAs by
+        the given factors (see the class docstring), with production
+        emissions F (by default, those of the base case).
+        With U the columns of the identity for the m changed rows and V the
+        change in these rows, the Woodbury identity gives
+            (A + U V)^-1 = A^-1 - A^-1 U (I + V A^-1 U)^-1 V A^-1
+        so each time step only needs a solve of size m.
+        '''
+        if F is None:
+            F = self.F
+        R, ID_R, dA, pert_R = self._rows(links)
+        m = len(R)
+        perturbed = self.perturbed.copy()
+        perturbed[:, R] = pert_R
+        b = np.array(F, dtype=float)
+        b[perturbed] = 0.
+        X_b = np.matmul(self.Ainv, b[:, :, np.newaxis])
+
+        AinvU = self.Ainv[:, :, R]
+        K = np.eye(m) + np.matmul(dA, AinvU)
+        y = _solve_dense(K, np.matmul(dA, X_b))
+        X = X_b - np.matmul(AinvU, y)
+        # Demand changes by the change in the net exports of the rows R
+        D = self.D.copy()
+        D[:, R] -= (ID_R - self.ID[:, R]).sum(axis=2)
+        return X[:, :, 0], D
+
+    def run(self, scenarios):
+        '''
+        Evaluate a list of scenarios. Scenarios that only change production
+        emissions are evaluated in one batch. Returns the (S, T, n) arrays
+        of consumption emissions intensities and of consumption emissions.
+        '''
+        S = len(scenarios)
+        T, n = self.F.shape
+        X = np.empty((S, T, n))
+        D = np.empty((S, T, n))
+        rhs = [k for k, sc in enumerate(scenarios) if not sc.get("ID")]
+        if rhs:
+            F = np.stack([self._scale_F(scenarios[k].get("F"))
+                          for k in rhs])
+            X[rhs] = self.emissions(F)
+            D[rhs] = self.D
+        for k, sc in enumerate(scenarios):
+            if sc.get("ID"):
+                X[k], D[k] = self.trade(sc["ID"], F=self._scale_F(
+                    sc.get("F")))
+        self.logger.debug("Evaluated %d scenarios, %d with trade changes" % (
+            S, S - len(rhs)))
+        return X, X * D
+
+
+def load_scenarios(poll="CO2", time_lev="H", df_j=None, eba=None):
+    '''
+    Create the SCENARIOS object for pollutant poll from the merged SEED data
+    (see SEED.load_SEED_data).
+    '''
+    if df_j is None:
+        df_j, eba = load_SEED_data([poll])
+    df_j = aggregate_time(df_j, time_lev)
+    P, ID = trade_arrays(df_j, eba)
+    F = df_j.loc[:, ["%s_%s_NG" % (poll, ba) for ba in eba.regions]].values
+    D = df_j.loc[:, eba.get_cols(field="D")].values
+    return SCENARIOS(F, P, ID, D, eba.regions, index=df_j.index)
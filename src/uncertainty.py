@@ -0,0 +1,171 @@
+'''
+Monte Carlo uncertainty propagation for consumption emissions.
+
+Generation, interchange and production emissions are perturbed with
+configurable noise models, and the consumption system is re-solved for each
+sample. Samples are stacked along the time axis, so that a chunk of samples
+is solved with one call to consumption_emissions_batch. Time steps are
+independent, so the computation is also split in chunks of time steps: for
+each time chunk, the samples are computed in parallel (in a process pool)
+and reduced to quantiles before moving on to the next one. Memory use is
+bounded by the size of one time chunk for all samples.
+'''
+import os
+import logging
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from load import data_file, write_data
+from SEED import (aggregate_time, consumption_emissions_batch, load_SEED_data,
+                  row_hours, trade_arrays, trade_pattern)
+
+DATA_PATH = os.getenv('DATA_PATH')
+if DATA_PATH is None:
+    raise ValueError("DATA_PATH needs to be set")
+
+# Default relative standard deviations of the noise on the inputs
+NOISE = {"P": 0.05, "ID": 0.05, "F": 0.1}
+
+
+def perturb(x, rel, model, rng):
+    '''
+    Return x multiplied by random factors with mean 1 and relative standard
+    deviation rel. model is "normal", "lognormal" or "uniform". Normal noise
+    is clipped so that factors are non-negative.
+    '''
+    if rel == 0.:
+        return x
+    if model == "normal":
+        eps = np.clip(rng.normal(1., rel, size=x.shape), 0., None)
+    elif model == "lognormal":
+        s2 = np.log(1. + rel ** 2)
+        eps = rng.lognormal(-s2 / 2., np.sqrt(s2), size=x.shape)
+    elif model == "uniform":
+        w = rel * np.sqrt(3.)
+        eps = rng.uniform(1. - w, 1. + w, size=x.shape)
+    else:
+        raise ValueError("Unknown noise model %s" % model)
+    return x * eps
+
+
+def sample_inputs(F, P, ID, n_samples, noise=None, model="normal",
+                  rng=None):
+    '''
+    Draw n_samples perturbed copies of the inputs, stacked along the time
+    axis: the returned arrays have shapes (n_samples * T, n, ...).
+    noise is a dict of relative standard deviations for "P", "ID" and "F"
+    (see NOISE). The same factor is used for ID[i, j] and ID[j, i], so that
+    perturbed interchange stays antisymmetric.
+    '''
+    if noise is None:
+        noise = NOISE
+    if rng is None:
+        rng = np.random.default_rng()
+    T, n = P.shape
+    tile = (n_samples,) + (1,) * (ID.ndim - 1)
+    F_s = perturb(np.tile(F, (n_samples,) + (1,) * (F.ndim - 1)),
+                  noise.get("F", 0.), model, rng)
+    P_s = perturb(np.tile(P, (n_samples, 1)), noise.get("P", 0.), model, rng)
+    ID_s = np.tile(ID, tile)
+    if noise.get("ID", 0.) != 0.:
+        eps = np.triu(perturb(np.ones((n_samples * T, n, n)), noise["ID"],
+                              model, rng), 1)
+        ID_s *= eps + eps.transpose((0, 2, 1))
+    return F_s, P_s, ID_s
+
+
+def _mc_chunk(F, P, ID, n_samples, seed, noise, model, kwargs):
+    '''
+    Solve the consumption system for n_samples perturbed inputs. Returns the
+    (n_samples, T, n, ...) arrays of consumption emissions intensities and of
+    consumption emissions.
+    '''
+    T, n = P.shape
+    F_s, P_s, ID_s = sample_inputs(F, P, ID, n_samples, noise=noise,
+                                   model=model,
+                                   rng=np.random.default_rng(seed))
+    X, _ = consumption_emissions_batch(F_s, P_s, ID_s, **kwargs)
+    X = X.reshape((n_samples, T) + X.shape[1:])
+    D_s = (P_s - ID_s.sum(axis=2)).reshape(
+        (n_samples, T, n) + (1,) * (X.ndim - 3))
+    return X.astype(np.float32), (X * D_s).astype(np.float32)
+
+
+def monte_carlo(F, P, ID, n_samples=1000, quantiles=(0.05, 0.5, 0.95),
+                noise=None, model="normal", seed=0, chunk_size=100,
+                sample_chunk=100, n_jobs=1, **kwargs):
+    '''
+    Propagate input uncertainty to consumption emissions.
+        F: (T, n) or (T, n, k) array of emissions produced
+        P: (T, n) array of generation
+        ID: (T, n, n) array of interchange
+        n_samples: number of Monte Carlo samples
+        quantiles: quantiles to report
+        noise, model: noise model (see sample_inputs)
+        seed: seed of the random number generator. Results do not depend on
+            n_jobs.
+        chunk_size: number of time steps in a time chunk
+        sample_chunk: number of samples solved in one batch
+        n_jobs: number of worker processes
+    Other keyword arguments are passed on to consumption_emissions_batch.
+    Returns two dicts, mapping each quantile to an array shaped like F, for
+    the consumption emissions intensities and the consumption emissions.
+    Samples for which the system is singular are ignored.
+    '''
+    logger = logging.getLogger('clean')
+    T = P.shape[0]
+    X_q = {q: np.full(np.shape(F), np.nan) for q in quantiles}
+    C_q = {q: np.full(np.shape(F), np.nan) for q in quantiles}
+    ss = np.random.SeedSequence(seed)
+    with Parallel(n_jobs=n_jobs) as parallel:
+        for start in range(0, T, chunk_size):
+            sl = slice(start, min(start + chunk_size, T))
+            logger.debug("Monte Carlo: time steps %d to %d" % (
+                sl.start, sl.stop))
+            seeds = ss.spawn(int(np.ceil(n_samples / sample_chunk)))
+            res = parallel(
+                delayed(_mc_chunk)(
+                    F[sl], P[sl], ID[sl],
+                    min(sample_chunk, n_samples - k * sample_chunk), sd,
+                    noise, model, kwargs)
+                for k, sd in enumerate(seeds))
+            X = np.concatenate([r[0] for r in res])
+            C = np.concatenate([r[1] for r in res])
+            for q, xq, cq in zip(
+                    quantiles, np.nanquantile(X, quantiles, axis=0),
+                    np.nanquantile(C, quantiles, axis=0)):
+                X_q[q][sl] = xq
+                C_q[q][sl] = cq
+    return X_q, C_q
+
+
+def makeSEED_MC(poll="CO2", time_lev="H", df_j=None, eba=None,
+                n_samples=1000, quantiles=(0.05, 0.5, 0.95), **kwargs):
+    '''
+    Run the Monte Carlo uncertainty propagation for pollutant poll (see
+    monte_carlo) and save the quantiles of consumption emissions and of
+    consumption emissions intensities in SEED_MC_<poll>_<time_lev>.csv,
+    with columns <poll>_<BA>_q<quantile> and <poll>i_<BA>_q<quantile>.
+    Intensities are in kg/MWh, as in SEED_EFs.
+    '''
+    logger = logging.getLogger('clean')
+    logger.info("Starting SEED Monte Carlo - %s - %s - %d samples" % (
+        poll, time_lev, n_samples))
+    if df_j is None:
+        df_j, eba = load_SEED_data([poll])
+    df_j = aggregate_time(df_j, time_lev)
+
+    P, ID = trade_arrays(df_j, eba)
+    F = df_j.loc[:, ["%s_%s_NG" % (poll, ba) for ba in eba.regions]].values
+    X_q, C_q = monte_carlo(F, P, ID, n_samples=n_samples,
+                           quantiles=quantiles, pattern=trade_pattern(eba),
+                           **kwargs)
+
+    cols = {}
+    for q in quantiles:
+        for i, ba in enumerate(eba.regions):
+            cols["%s_%s_q%02d" % (poll, ba, round(100 * q))] = C_q[q][:, i]
+            cols["%si_%s_q%02d" % (poll, ba, round(100 * q))] = (
+                1000 / row_hours(time_lev) * X_q[q][:, i])
+    write_data(pd.DataFrame(cols, index=df_j.index),
+               data_file("SEED_MC_%s_%s" % (poll, time_lev)))